@@ -1,8 +1,15 @@
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from functools import partial
+
 from ovos_workshop.decorators import intent_handler
 from ovos_workshop.skills import OVOSSkill
 from ovos_utils.process_utils import RuntimeRequirements
 from ovos_utils import classproperty
-from .pyedaman import PyEdaman
+from .pyedaman import (PyEdaman, APIError, CredentialPool, MealLog, Metrics,
+                       RateLimiter)
 
 
 class NutrientsSkill(OVOSSkill):
@@ -18,62 +25,365 @@ class NutrientsSkill(OVOSSkill):
                                    no_network_fallback=False,
                                    no_gui_fallback=True)
 
+    def initialize(self):
+        # free keys for the people
+        self.settings.setdefault("recipes_appid", 'eceecbfb')
+        self.settings.setdefault("recipes_appkey", '83347a87348057d5ab183aade8106646')
+        self.settings.setdefault("nutrition_appid", '5a32958e')
+        self.settings.setdefault("nutrition_appkey", 'cabec6b9addb1666e1365303e509f450')
+        self.settings.setdefault("food_appid", "07d50733")
+        self.settings.setdefault("food_appkey", "80fcb49b500737827a9a23f7049653b9")
+        # extra "appid:appkey, appid:appkey" pairs sharing the load
+        self.settings.setdefault("recipes_keys", "")
+        self.settings.setdefault("nutrition_keys", "")
+        self.settings.setdefault("food_keys", "")
+        # seconds an intent may wait for a cooling key before giving up
+        self.settings.setdefault("key_max_wait", 5)
+        self.settings.setdefault("cache_size", 512)
+        self.settings.setdefault("cache_ttl", 3600)
+        self.settings.setdefault("instructions_max_age", 7 * 24 * 3600)
+        # requests per minute per api key, free edamam plans allow 10
+        self.settings.setdefault("rate_limit", 10)
+        # seconds of silence before saying "still looking"
+        self.settings.setdefault("calories_budget", 3)
+        self.settings.setdefault("ingredients_budget", 4)
+        # seconds after which a late answer is dropped
+        self.settings.setdefault("calories_deadline", 15)
+        self.settings.setdefault("ingredients_deadline", 20)
+        # concurrent requests for one meal log, the rate limit still applies
+        self.settings.setdefault("meal_log_workers", 8)
+        self._edaman = None
+        self._food_index = None
+        self._instruction_cache = None
+        self._recipe_index = None
+        self._executor = None
+        # outlives client rebuilds so counters survive settings changes
+        self.metrics = Metrics()
+        self.settings_change_callback = self.on_settings_changed
+        self.add_event("skill-nutrients.metrics", self.handle_metrics_request)
+        self.add_event("skill-nutrients.meal_log", self.handle_meal_log_request)
+
+    def on_settings_changed(self):
+        # keys may have changed, rebuild the client on next use
+        if self._edaman is not None:
+            self._edaman.close()
+        self._edaman = None
+        if self._instruction_cache is not None:
+            self._instruction_cache.max_age = float(
+                self.settings["instructions_max_age"])
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=4)
+        return self._executor
+
+    @property
+    def food_index(self):
+        if self._food_index is None:
+            from .food_index import FoodIndex
+            path = os.path.join(self.file_system.path, "foods.db")
+            self._food_index = FoodIndex(path)
+        return self._food_index
+
+    @property
+    def instruction_cache(self):
+        if self._instruction_cache is None:
+            from .instruction_cache import InstructionCache
+            path = os.path.join(self.file_system.path, "instructions.db")
+            self._instruction_cache = InstructionCache(
+                path, max_age=float(self.settings["instructions_max_age"]))
+        return self._instruction_cache
+
+    @property
+    def recipe_index(self):
+        if self._recipe_index is None:
+            from .recipe_index import RecipeIndex
+            path = os.path.join(self.file_system.path, "recipes.db")
+            self._recipe_index = RecipeIndex(path)
+        return self._recipe_index
+
+    def _keys(self, api):
+        """ CredentialPool of the api's appid / appkey pair and its extra keys """
+        keys = [(self.settings[api + "_appid"], self.settings[api + "_appkey"])]
+        for pair in re.split(r"[,\s]+", self.settings[api + "_keys"] or ""):
+            app_id, _, app_key = pair.partition(":")
+            if app_id and app_key and (app_id, app_key) not in keys:
+                keys.append((app_id, app_key))
+        return CredentialPool(keys,
+                              max_wait=float(self.settings["key_max_wait"]))
+
     @property
     def edaman(self):
-        # free keys for the people
-        if "recipes_appid" not in self.settings:
-            self.settings["recipes_appid"] = 'eceecbfb'
-        if "recipes_appkey" not in self.settings:
-            self.settings["recipes_appkey"] = '83347a87348057d5ab183aade8106646'
-        if "nutrition_appid" not in self.settings:
-            self.settings["nutrition_appid"] = '5a32958e'
-        if "nutrition_appkey" not in self.settings:
-            self.settings["nutrition_appkey"] = 'cabec6b9addb1666e1365303e509f450'
-        if "food_appid" not in self.settings:
-            self.settings["nutrition_appid"] = "07d50733"
-        if "food_appkey" not in self.settings:
-            self.settings["nutrition_appkey"] = "80fcb49b500737827a9a23f7049653b9"
-
-        return PyEdaman(nutrition_appid=self.settings["nutrition_appid"],
-                               nutrition_appkey=self.settings["nutrition_appkey"],
-                               recipes_appid=self.settings["recipes_appid"],
-                               recipes_appkey=self.settings["recipes_appkey"],
-                               food_appid=self.settings["food_appid"],
-                               food_appkey=self.settings["food_appkey"])
+        if self._edaman is None:
+            calls = int(self.settings["rate_limit"])
+            self._edaman = PyEdaman(nutrition_appid=self.settings["nutrition_appid"],
+                                    nutrition_appkey=self.settings["nutrition_appkey"],
+                                    recipes_appid=self.settings["recipes_appid"],
+                                    recipes_appkey=self.settings["recipes_appkey"],
+                                    food_appid=self.settings["food_appid"],
+                                    food_appkey=self.settings["food_appkey"],
+                                    nutrition_keys=self._keys("nutrition"),
+                                    recipes_keys=self._keys("recipes"),
+                                    food_keys=self._keys("food"),
+                                    cache_size=int(self.settings["cache_size"]),
+                                    cache_ttl=float(self.settings["cache_ttl"]),
+                                    food_index=self.food_index,
+                                    recipe_index=self.recipe_index,
+                                    instruction_cache=self.instruction_cache,
+                                    metrics=self.metrics,
+                                    rate_limiter=RateLimiter(calls) if calls else None)
+        return self._edaman
+
+    def _within_budget(self, future, intent, late):
+        """ (result, True) if future finishes within the intent's latency
+        budget, otherwise says "still looking" and returns (None, False),
+        late(result) is then called if the answer arrives before the
+        intent's deadline, after it future is cancelled and the user told
+        so """
+        budget = float(self.settings[intent + "_budget"])
+        try:
+            return future.result(timeout=budget), True
+        except TimeoutError:
+            pass
+        self.metrics.incr("intent.%s.over_budget" % intent)
+        # TODO dialog file
+        self.speak("still looking")
+
+        def give_up():
+            # loses against an answer that is already being spoken
+            if future.cancel():
+                self.metrics.incr("intent.%s.gave_up" % intent)
+                # TODO dialog file
+                self.speak("sorry, that is taking too long")
+
+        deadline = float(self.settings[intent + "_deadline"])
+        timer = threading.Timer(max(0.0, deadline - budget), give_up)
+        timer.daemon = True
+        timer.start()
+
+        def answer(future):
+            timer.cancel()
+            if future.cancelled():
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                self.log.debug(f"late {intent} lookup failed: {e!r}")
+                result = None
+            late(result)
+
+        future.add_done_callback(answer)
+        return None, False
+
+    def _first_recipe(self, sentence, coalesce=True):
+        # only the first hit is used, don't download a whole page
+        return next(self.edaman.search_recipe(sentence, max_results=1,
+                                              coalesce=coalesce), None)
 
     @intent_handler("ingredients.intent")
     def handle_ingredients_intent(self, message):
         sentence = message.data["sentence"]
-        # TODO use dialog file
-        for recipe in self.edaman.search_recipe(sentence):
-            sentences = (f["text"] for f in recipe.ingredient_quantities)
-            self.enclosure.deactivate_mouth_events()
-            for idx, s in enumerate(sentences):
-                if idx >= 2:
-                    self.enclosure.deactivate_mouth_events()
-                    self.enclosure.mouth_text(s)
-                self.speak(s, wait=True)
-            self.enclosure.activate_mouth_events()
-            break
-        else:
+        with self.metrics.timer("intent.ingredients"):
+            future = self.edaman.submit_hedged(
+                self.executor, "recipe",
+                partial(self._first_recipe, sentence),
+                partial(self._first_recipe, sentence, coalesce=False))
+            with self.metrics.timer("intent.ingredients.lookup"):
+                recipe, in_time = self._within_budget(
+                    future, "ingredients", self._speak_ingredients)
+            if in_time:
+                with self.metrics.timer("intent.ingredients.speak"):
+                    self._speak_ingredients(recipe)
+
+    def _speak_ingredients(self, recipe):
+        if recipe is None:
+            self.metrics.incr("intent.ingredients.unknown")
             # TODO dialog file
             self.speak("unknown food")
+            return
+        # TODO use dialog file
+        sentences = (f["text"] for f in recipe.ingredient_quantities)
+        self.enclosure.deactivate_mouth_events()
+        for idx, s in enumerate(sentences):
+            if idx >= 2:
+                self.enclosure.deactivate_mouth_events()
+                self.enclosure.mouth_text(s)
+            self.speak(s, wait=True)
+        self.enclosure.activate_mouth_events()
+
+    def _lookup_nutrient(self, query, coalesce=True):
+        try:
+            for nutrient_data in self.edaman.search_nutrient(
+                    query, coalesce=coalesce):
+                return nutrient_data
+        except APIError as e:
+            self.log.debug(f"nutrient lookup failed for '{query}': {e!r}")
+        return None
+
+    @staticmethod
+    def _first_found(futures):
+        """ future of the first result that is not None, in list order
+
+        later futures are cancelled once an earlier one found something"""
+        found = Future()
+        lock = threading.Lock()
+        settled = []
+
+        def check(_):
+            with lock:
+                if settled:
+                    return
+                value = None
+                for future in futures:
+                    if not future.done():
+                        return
+                    if not future.cancelled() and \
+                            future.exception() is None and \
+                            future.result() is not None:
+                        value = future.result()
+                        break
+                settled.append(value)
+            for future in futures:
+                future.cancel()
+            # found may have been cancelled by the caller meanwhile
+            if found.set_running_or_notify_cancel():
+                found.set_result(value)
+
+        def cancel(found):
+            if found.cancelled():
+                for future in futures:
+                    future.cancel()
+
+        for future in futures:
+            future.add_done_callback(check)
+        found.add_done_callback(cancel)
+        return found
 
     @intent_handler("calories.intent")
     def handle_calories_intent(self, message):
         sentence = message.data["sentence"]
-        for nutrient_data in self.edaman.search_nutrient(sentence):
+        with self.metrics.timer("intent.calories"):
+            # both phrasings are sent at once, answers are still picked in
+            # priority order so the result matches asking them one by one,
+            # each one is hedged if it gets slower than usual
+            queries = [sentence, "1 gram of " + sentence]
+            answer = self._first_found([self.edaman.submit_hedged(
+                self.executor, "nutrient",
+                partial(self._lookup_nutrient, q),
+                partial(self._lookup_nutrient, q, coalesce=False))
+                for q in queries])
+            with self.metrics.timer("intent.calories.lookup"):
+                nutrient_data, in_time = self._within_budget(
+                    answer, "calories", self._speak_calories)
+            if in_time:
+                with self.metrics.timer("intent.calories.speak"):
+                    self._speak_calories(nutrient_data)
+
+    def _speak_calories(self, nutrient_data):
+        if nutrient_data is not None:
             # TODO dialog file
             speak = f"{nutrient_data} has {nutrient_data.calories} calores"
             self.speak(speak)
-            break
         else:
-            query = "1 gram of " + sentence
-            for nutrient_data in self.edaman.search_nutrient(query):
-                # TODO dialog file
-                speak = f"{nutrient_data} has {nutrient_data.calories} calores"
-                self.speak(speak)
-                break
-            else:
+            self.metrics.incr("intent.calories.unknown")
+            # TODO dialog file
+            self.speak("unknown food")
+
+    def _analyze_meal_log(self, lines, on_line=None):
+        """ MealLog for lines, on_line(line, ingredient, error, log) is
+        called as each distinct line completes """
+        log = MealLog(lines)
+        with self.metrics.timer("meal_log"):
+            for line, ingredient, error in self.edaman.iter_meal_log(
+                    log.lines, max_workers=int(self.settings["meal_log_workers"])):
+                log.add(line, ingredient, error)
+                if error is not None:
+                    self.log.debug(f"meal log line '{line}' failed: {error!r}")
+                if on_line is not None:
+                    on_line(line, ingredient, error, log)
+        return log
+
+    @intent_handler("meal.intent")
+    def handle_meal_intent(self, message):
+        # "two eggs, a toast, then 1 cup of coffee", "and" stays inside
+        # lines so "mac and cheese" is one food, parse_quantity treats
+        # other "and" lines as compound and sends them unscaled
+        lines = re.split(r",|;|\bthen\b", message.data["sentence"])
+        with self.metrics.timer("intent.meal"):
+            log = self._analyze_meal_log(lines)
+            if not log.results:
+                self.metrics.incr("intent.meal.unknown")
                 # TODO dialog file
                 self.speak("unknown food")
+                return
+            # TODO dialog file
+            self.speak(f"that is {log.calories} calories in total")
+            for line in log.failed:
+                # TODO dialog file
+                self.speak(f"I could not find {line}")
+
+    @staticmethod
+    def _nutrients_json(nutrients):
+        return {n.tag: {"label": n.label, "quantity": n.quantity,
+                        "unit": n.unit} for n in nutrients}
+
+    def handle_meal_log_request(self, message):
+        """ analyze {"lines": [...]} of a meal log
+
+        each distinct line is answered with a skill-nutrients.meal_log.line
+        message as soon as it is done, the response carries per line
+        calories and the daily totals, anything but a list of strings is
+        answered with {"error": ...}"""
+        lines = message.data.get("lines") or []
+        if not isinstance(lines, list) or \
+                not all(isinstance(line, str) for line in lines):
+            self.bus.emit(message.response(
+                {"error": "lines must be a list of strings"}))
+            return
+
+        def on_line(line, ingredient, error, log):
+            data = {"line": line, "error": None if error is None else str(error),
+                    "calories": None, "totalWeight": None,
+                    "progress": len(log.results) + len(log.errors),
+                    "running_calories": log.calories}
+            if ingredient is not None:
+                data["calories"] = ingredient.calories
+                data["totalWeight"] = ingredient.totalWeight
+            self.bus.emit(message.reply("skill-nutrients.meal_log.line", data))
+
+        log = self._analyze_meal_log(lines, on_line)
+        lines = []
+        for line, ing in zip(log.lines, log.ingredients):
+            lines.append({"line": line,
+                          "calories": None if ing is None else ing.calories})
+        self.bus.emit(message.response({
+            "lines": lines,
+            "failed": log.failed,
+            "calories": log.calories,
+            "totalNutrients": self._nutrients_json(log.totalNutrients),
+            "totalDaily": self._nutrients_json(log.totalDaily)}))
+
+    def handle_metrics_request(self, message):
+        """ answer skill-nutrients.metrics with a snapshot of the counters
+        and per api key usage (app ids only)
+
+        send {"format": "prometheus"} to also get the text exposition"""
+        data = {"metrics": self.metrics.snapshot(),
+                "keys": self.edaman.key_usage()}
+        if message.data.get("format") == "prometheus":
+            data["prometheus"] = self.metrics.prometheus()
+        self.bus.emit(message.response(data))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._edaman is not None:
+            self._edaman.close()
+        if self._food_index is not None:
+            self._food_index.close()
+        if self._instruction_cache is not None:
+            self._instruction_cache.close()
+        if self._recipe_index is not None:
+            self._recipe_index.close()
+        super().shutdown()
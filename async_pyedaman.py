@@ -0,0 +1,339 @@
+import asyncio
+import json
+
+import aiohttp
+
+try:
+    from .pyedaman import Edaman, MealLog, PyEdaman, TTLCache, _MISSING
+except ImportError:  # running from a checkout
+    from pyedaman import Edaman, MealLog, PyEdaman, TTLCache, _MISSING
+
+
+class AsyncEdaman(Edaman):
+    """ asyncio low level api returning raw json data
+
+    same endpoints and exceptions as Edaman, backed by a pooled aiohttp
+    session so thousands of lookups can share one event loop. api calls
+    don't go through a Transport, replay them by pointing base_url at a
+    replay.EdamamStandInServer, scrape_transport is still used"""
+
+    def __init__(self, *args, transport=None, **kwargs):
+        if transport is not None:
+            raise ValueError("api calls of the asyncio client go through "
+                             "aiohttp, replay them with base_url and "
+                             "replay.EdamamStandInServer")
+        super().__init__(*args, **kwargs)
+        self._session = None
+
+    @property
+    def session(self):
+        """ pooled aiohttp session, created inside the running loop """
+        if self._session is None:
+            self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        if isinstance(self.timeout, (tuple, list)):
+            connect, read = self.timeout
+        else:
+            connect = read = self.timeout
+        connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                         keepalive_timeout=30)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect,
+                                          sock_read=read),
+            headers={"Accept-Encoding": "gzip, deflate"})
+
+    async def close(self):
+        """ release pooled connections """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.scrape_transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _send(self, endpoint, method, url, params=None, **kwargs):
+        """ timed request returning (status, json), see Edaman._send """
+        tried = []
+        while True:
+            credential, wait = self._credential(endpoint, tried)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                with self.metrics.timer("api." + endpoint):
+                    async with self.session.request(
+                            method, url,
+                            params=self._keyed(params, credential),
+                            **kwargs) as r:
+                        status = r.status
+                        retry_after = r.headers.get("Retry-After")
+                        if status >= 400 and \
+                                status != self.LOW_QUALITY_STATUS:
+                            # error pages aren't always json
+                            data = None
+                        else:
+                            with self.metrics.timer("decode." + endpoint):
+                                data = await r.json(content_type=None)
+            except aiohttp.ClientError:
+                self.metrics.incr("errors.transport")
+                raise
+            self._count_status(endpoint, status)
+            if not self._retry_key(endpoint, credential, status, retry_after,
+                                   tried):
+                return status, data
+
+    async def search_recipe(self, query="chicken", start=None, end=None):
+        url, params = self._recipe_request(query, start, end)
+        status, data = await self._send("recipe", "GET", url, params=params)
+        self._check_recipe_status(status)
+        self._check_http(status)
+        return data
+
+    async def search_nutrient(self, ingredients=None):
+        url, params, data = self._nutrient_request(ingredients)
+        status, data = await self._send(
+            "nutrient", "POST", url, params=params,
+            headers={"Content-Type": "application/json"},
+            data=json.dumps(data))
+        self._check_nutrient_status(status)
+        self._check_http(status, (self.LOW_QUALITY_STATUS,))
+        return self._check_nutrient_data(data)
+
+    async def search_food(self, query="pizza"):
+        url, params = self._food_request(query)
+        status, data = await self._send("food", "GET", url, params=params)
+        self._check_food_status(status)
+        self._check_http(status)
+        return self._check_food_data(data)
+
+
+class AsyncPyEdaman(AsyncEdaman, PyEdaman):
+    """ asyncio high level api generating data objects
+
+    same search methods and arguments as PyEdaman, as async generators.
+    recipe pages are decoded whole instead of hit by hit, and the pages
+    of a search share the sync client's cache keys"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sync_client = None
+        # key -> task of the in-flight request, see PyEdaman.inflight
+        self._tasks = {}
+
+    @property
+    def sync_client(self):
+        """ blocking client handed to Recipe objects, shares keys and cache """
+        if self._sync_client is None:
+            self._sync_client = PyEdaman(
+                nutrition_appid=self.nutrition_appid,
+                nutrition_appkey=self.nutrition_appkey,
+                recipes_appid=self.recipes_appid,
+                recipes_appkey=self.recipes_appkey,
+                food_appid=self.food_appid,
+                food_appkey=self.food_appkey,
+                timeout=self.timeout,
+                pool_size=self.pool_size,
+                base_url=self.base_url,
+                scrape_transport=self.scrape_transport,
+                cache_size=0,
+                instruction_cache=self.instruction_cache,
+                metrics=self.metrics,
+                rate_limiter=self.rate_limiter,
+                prefetcher=self.prefetcher,
+                nutrition_keys=self.credentials["nutrient"],
+                recipes_keys=self.credentials["recipe"],
+                food_keys=self.credentials["food"])
+            self._sync_client.cache = self.cache
+        return self._sync_client
+
+    async def close(self):
+        await super().close()
+        if self._sync_client is not None:
+            self._sync_client.close()
+
+    def _make_recipe(self, hit, edamam=None):
+        return super()._make_recipe(hit, edamam or self.sync_client)
+
+    async def _cached(self, endpoint, query, fetch, coalesce=True,
+                      key=None):
+        if key is None:
+            key = (endpoint, TTLCache.normalize(query))
+        if self.cache is not None:
+            data = self.cache.get(key, _MISSING)
+            if data is not _MISSING:
+                self.metrics.incr("cache.%s.hit" % endpoint)
+                return data
+            self.metrics.incr("cache.%s.miss" % endpoint)
+        if self.inflight is None or not coalesce:
+            return await self._fetch(key, fetch, query)
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, fetch, query))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None))
+        else:
+            self.metrics.incr("coalesced.%s" % endpoint)
+        # a cancelled caller must not cancel the request others wait on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, fetch, query):
+        data = await fetch(query)
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data
+
+    async def _analyze(self, ingredients, name, coalesce=True):
+        quantity = self._portion(ingredients)
+        query = ingredients if quantity is None else quantity.base
+        data = await self._cached("nutrient", query,
+                                  super().search_nutrient, coalesce)
+        return self._make_ingredient(self._scaled(data, quantity), name)
+
+    async def _recipe_page(self, query, start, end, coalesce=True):
+        """ raw hits in [start, end), see PyEdaman._recipe_page """
+        search = super().search_recipe
+
+        async def fetch(query):
+            data = await search(query, start, end)
+            hits = (data.get("hits") or [])[:end - start]
+            if self.recipe_index is not None and hits:
+                self.recipe_index.add(hits)
+            return hits
+
+        return await self._cached(
+            "recipe", query, fetch, coalesce,
+            key=("recipe", TTLCache.normalize(query), start, end))
+
+    async def search_recipe(self, query, page_size=10, max_results=100,
+                            prefetch=False, coalesce=True):
+        """ async generator of Recipe, see PyEdaman.search_recipe """
+        if self.recipe_index is not None:
+            hits = self.recipe_index.lookup(
+                query, max_results if max_results is not None else page_size)
+            self.metrics.incr("recipe_index.%s" %
+                              ("miss" if hits is None else "hit"))
+            if hits is not None:
+                for rank, hit in enumerate(hits):
+                    yield self._prefetch(self._make_recipe(hit), rank)
+                return
+        upcoming = None
+        start = 0
+        try:
+            while max_results is None or start < max_results:
+                end = start + page_size
+                if max_results is not None:
+                    end = min(end, max_results)
+                if upcoming is not None:
+                    hits = await upcoming
+                else:
+                    hits = await self._recipe_page(query, start, end,
+                                                   coalesce)
+                if prefetch:
+                    nxt = end + page_size
+                    if max_results is not None:
+                        nxt = min(nxt, max_results)
+                    upcoming = asyncio.ensure_future(self._recipe_page(
+                        query, end, nxt, coalesce)) if nxt > end else None
+
+                for rank, hit in enumerate(hits, start):
+                    yield self._prefetch(self._make_recipe(hit), rank)
+                if len(hits) < end - start:
+                    break  # last page
+                start = end
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+
+    async def search_nutrient(self, ingredients=None, batch=False,
+                              max_workers=1, coalesce=True):
+        """ async generator of Ingredient, see PyEdaman.search_nutrient """
+        ingredients = ingredients or []
+        if isinstance(ingredients, str):
+            ingredients = [ingredients]
+        if not ingredients:
+            return
+        if batch:
+            yield await self._analyze(list(ingredients),
+                                      ", ".join(ingredients), coalesce)
+        elif max_workers > 1 and len(ingredients) > 1:
+            sem = asyncio.Semaphore(max_workers)
+
+            async def bounded(ing):
+                async with sem:
+                    return await self._analyze(ing, ing, coalesce)
+
+            tasks = [asyncio.ensure_future(bounded(ing))
+                     for ing in ingredients]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+        else:
+            for ing in ingredients:
+                yield await self._analyze(ing, ing, coalesce)
+
+    async def search_food(self, query, coalesce=True):
+        if self.food_index is not None:
+            parsed = self.food_index.lookup(query)
+            self.metrics.incr("food_index.%s" % ("hit" if parsed else "miss"))
+            if parsed:
+                for food in parsed:
+                    yield self._make_food(food)
+                return
+        data = await self._cached("food", query, super().search_food,
+                                  coalesce)
+        if self.food_index is not None and data["parsed"]:
+            self.food_index.add(query, data["parsed"])
+        for food in data["parsed"]:
+            yield self._make_food(food)
+
+    async def iter_meal_log(self, lines, max_workers=8):
+        """ async generator of (line, Ingredient, error), see
+        PyEdaman.iter_meal_log """
+        unique = {}
+        for line in lines:
+            key = TTLCache.normalize(line)
+            if key and key not in unique:
+                unique[key] = line.strip()
+        if not unique:
+            return
+        sem = asyncio.Semaphore(max_workers)
+
+        async def bounded(line):
+            async with sem:
+                try:
+                    return line, await self._analyze(line, line), None
+                except Exception as e:
+                    self.metrics.incr("meal_log.errors")
+                    return line, None, e
+
+        tasks = [asyncio.ensure_future(bounded(line))
+                 for line in unique.values()]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def analyze_meal_log(self, lines, max_workers=8):
+        log = MealLog(lines)
+        async for line, ingredient, error in self.iter_meal_log(
+                log.lines, max_workers):
+            log.add(line, ingredient, error)
+        return log
+
+    async def get_ingredients_data(self, recipe, batch=False, max_workers=8):
+        """ async counterpart of Recipe.get_ingredients_data """
+        async for ing in self.search_nutrient(recipe.ingredient_names,
+                                              batch=batch,
+                                              max_workers=max_workers):
+            yield ing
@@ -0,0 +1,166 @@
+"""offline benchmarks for pyedaman, no network or api quota needed
+
+    python benchmarks/bench.py [--iterations 200] [--only recipe]
+                               [--pages DIR] [--output results.json]
+                               [--compare previous.json]
+
+api calls are answered from the json in benchmarks/fixtures, recipe pages
+come from benchmarks/pages.py. Every benchmark reports throughput and
+p50/p90/p99 latency in microseconds, --output writes them as json and
+--compare prints the throughput ratio against an earlier run"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import pyedaman  # noqa: E402
+from pages import DOM, PROVIDERS, load_pages  # noqa: E402
+from replay import FixtureTransport  # noqa: E402
+
+FIXTURES = os.path.join(HERE, "fixtures")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def measure(func, iterations, warmup=5):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6
+
+    return {"iterations": iterations,
+            "ops_per_sec": iterations / sum(samples),
+            "mean_us": statistics.fmean(samples) * 1e6,
+            "p50_us": pct(0.50),
+            "p90_us": pct(0.90),
+            "p99_us": pct(0.99)}
+
+
+def build_benchmarks(pages_dir=None):
+    client = pyedaman.PyEdaman(
+        transport=FixtureTransport.from_directory(FIXTURES), cache_size=0)
+    recipe_hit = load_fixture("recipe_search.json")["hits"][0]
+    nutrition = load_fixture("nutrition_details.json")
+    pages = load_pages(pages_dir)
+
+    def first_hit():
+        hits = client.search_recipe("onion and chicken", max_results=1)
+        next(hits)
+        hits.close()
+
+    def recipe_decoded():
+        recipe = client._make_recipe(recipe_hit)
+        return recipe.totalNutrients, recipe.totalDaily, recipe.digest
+
+    def ingredient_decoded():
+        ing = client._make_ingredient(nutrition, "1 large apple")
+        return ing.totalNutrients, ing.totalDaily, ing.totalNutrientsKCal
+
+    search_text = json.dumps(load_fixture("recipe_search.json"))
+    snapshot = pyedaman.dumps_snapshot(
+        [client._make_recipe(hit) for hit in json.loads(search_text)["hits"]])
+
+    benchmarks = {
+        "client.search_recipe.page": lambda: list(client.search_recipe(
+            "onion and chicken", page_size=20, max_results=20)),
+        "client.search_recipe.first_hit": first_hit,
+        "client.search_nutrient": lambda: list(
+            client.search_nutrient("1 large apple")),
+        "client.search_food": lambda: list(client.search_food("pizza")),
+        "Recipe.construct": lambda: client._make_recipe(recipe_hit),
+        "Recipe.construct_decoded": recipe_decoded,
+        "Ingredient.construct": lambda: client._make_ingredient(
+            nutrition, "1 large apple"),
+        "Ingredient.construct_decoded": ingredient_decoded,
+        # 20 recipes, from api json vs from a binary snapshot
+        "Recipe.from_json": lambda: [client._make_recipe(hit) for hit in
+                                     json.loads(search_text)["hits"]],
+        "Recipe.from_snapshot": lambda: pyedaman.loads_snapshot(snapshot,
+                                                                client),
+    }
+
+    try:
+        import bs4  # noqa: F401
+        missing = None
+    except ImportError as e:
+        missing = e
+
+    def unavailable():
+        raise missing
+
+    recipe = client._make_recipe(recipe_hit)
+    for source in PROVIDERS:
+        if source in DOM and missing is not None:
+            # _get_provider_result swallows errors, don't time a failure
+            benchmarks["extract." + source] = unavailable
+            continue
+        benchmarks["extract." + source] = \
+            lambda s=source: recipe._get_provider_result(s, pages[s])
+    return benchmarks
+
+
+def compare(results, previous):
+    print("%-40s %12s %12s %8s" % ("benchmark", "before", "after", "ratio"))
+    for name, stats in results.items():
+        old = previous.get(name)
+        if not old or "ops_per_sec" not in old or "ops_per_sec" not in stats:
+            continue
+        print("%-40s %12.1f %12.1f %7.2fx" % (
+            name, old["ops_per_sec"], stats["ops_per_sec"],
+            stats["ops_per_sec"] / old["ops_per_sec"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", help="regex, run matching benchmarks only")
+    parser.add_argument("--pages", help="directory with saved <source>.html")
+    parser.add_argument("--output", help="write json results to this file")
+    parser.add_argument("--compare", help="json results of a previous run")
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in build_benchmarks(args.pages).items():
+        if args.only and not re.search(args.only, name):
+            continue
+        try:
+            results[name] = measure(func, args.iterations)
+        except ImportError as e:  # eg. bs4 missing for DOM extractors
+            results[name] = {"skipped": str(e)}
+            continue
+        print("%-40s %10.1f ops/s  p50 %9.1fus  p99 %9.1fus" % (
+            name, results[name]["ops_per_sec"], results[name]["p50_us"],
+            results[name]["p99_us"]))
+
+    report = {"meta": {"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "iterations": args.iterations,
+                       "timestamp": time.time()},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""recipe pages for offline extraction benchmarks
+
+real pages can't be redistributed, so each provider known to
+Recipe._get_provider_result gets a generated page reproducing the markup
+its extractor relies on, padded with ad/nav noise to a realistic size.
+Saved pages named <source>.html in a --pages directory take precedence"""
+import json
+import os
+
+STEPS = ["Preheat the oven to 200C and line a tray with baking paper.",
+         "Slice the onions into thin half moons.",
+         "Season the chicken thighs with salt, pepper and smoked paprika.",
+         "Brown the chicken in olive oil, 4 minutes per side.",
+         "Add the onions and garlic and cook until soft.",
+         "Pour in the stock, cover and bake for 30 minutes.",
+         "Rest for 5 minutes and scatter with parsley before serving."]
+
+# source -> how the instructions are published
+LD_OBJECT = ("epicurious", "bonappetit", "bbcgoodfood", "delish",
+             "pioneerwoman", "latimes", "saveur", "food.com",
+             "foxeslovelemons.com")
+LD_STRINGS = ("bbc", "justapinch.com")
+LD_LIST = ("seriouseats", "foodandwine", "foodnetwork", "simplyrecipes")
+LD_LIST_SECOND = ("eatingwell",)
+LD_SECOND_SCRIPT = ("tastingtable", "cookstr")
+LD_GRAPH = ("whiteonricecouple", "nomnompaleo")
+DOM = ("food52", "marthastewart", "honestcooking", "closetcooking",
+       "cookalmostanything", "foodrepublic", "thedailymeal",
+       "frenchrevolutionfood", "foodista", "turniptheoven.com",
+       "tastykitchen.com")
+PROVIDERS = LD_OBJECT + LD_STRINGS + LD_LIST + LD_LIST_SECOND + \
+    LD_SECOND_SCRIPT + LD_GRAPH + DOM
+
+
+def _recipe(strings=False):
+    steps = STEPS if strings else [{"@type": "HowToStep", "text": s}
+                                   for s in STEPS]
+    return {"@context": "https://schema.org", "@type": "Recipe",
+            "name": "Onion Chicken", "recipeYield": "4",
+            "recipeIngredient": ["2 pounds chicken thighs", "1 large onion"],
+            "recipeInstructions": steps}
+
+
+def _ld(data):
+    return '<script type="application/ld+json">%s</script>' % json.dumps(data)
+
+
+def _noise(size):
+    block = ('<div class="ad-slot" data-ad="leaderboard"><iframe src="about:blank">'
+             '</iframe></div><nav class="menu"><ul><li><a href="/a">Dinner</a>'
+             '</li><li><a href="/b">Desserts</a></li></ul></nav>'
+             '<p class="promo">Sign up for our newsletter!</p>\n')
+    return block * max(1, size // len(block))
+
+
+def _dom(source):
+    li = "".join("<li>%s</li>" % s for s in STEPS)
+    if source == "food52":
+        return '<div class="recipe__list--steps"><ol>%s</ol></div>' % li
+    if source == "marthastewart":
+        return '<ul class="instructions-section">%s</ul>' % "".join(
+            '<li><div class="section-body"><p>%s</p></div></li>' % s
+            for s in STEPS)
+    if source == "honestcooking":
+        return "<ol>%s</ol>" % "".join(
+            '<li itemprop="recipeInstructions">%s</li>' % s for s in STEPS)
+    if source == "closetcooking":
+        return '<ol class="instructions">%s</ol>' % li
+    if source == "cookalmostanything":
+        return '<div class="post-body"><center>ad</center>%s</div>' % \
+            "<br>".join(STEPS)
+    if source == "foodrepublic":
+        return '<span itemprop="recipeInstructions"><ol>%s</ol></span>' % li
+    if source == "thedailymeal":
+        return '<ol class="recipe-directions">%s</ol>' % li
+    if source == "frenchrevolutionfood":
+        return '<div class="recipe"><ol>%s</ol></div>' % li
+    if source == "foodista":
+        return "".join('<div class="step-body">%s</div>' % s for s in STEPS)
+    if source == "turniptheoven.com":
+        return '<ol itemprop="recipeInstructions">%s</ol>' % li
+    if source == "tastykitchen.com":
+        return '<span itemprop="instructions">%s</span>' % "".join(
+            "<p>%s</p>" % s for s in STEPS)
+    raise KeyError(source)
+
+
+def generate_page(source, size=300_000):
+    """ html for source, json-ld in <head>, DOM instructions mid body """
+    head, body = "", ""
+    org = _ld({"@context": "https://schema.org", "@type": "Organization",
+               "name": source})
+    if source in LD_OBJECT:
+        head = _ld(_recipe())
+    elif source in LD_STRINGS:
+        head = _ld(_recipe(strings=True))
+    elif source in LD_LIST:
+        head = _ld([_recipe()])
+    elif source in LD_LIST_SECOND:
+        head = _ld([{"@type": "WebPage"}, _recipe()])
+    elif source in LD_SECOND_SCRIPT:
+        head = org + _ld(_recipe())
+    elif source in LD_GRAPH:
+        head = _ld({"@context": "https://schema.org",
+                    "@graph": [{"@type": "WebSite"}, _recipe()]})
+    else:
+        body = _dom(source)
+    noise = _noise(size // 2)
+    return ("<!DOCTYPE html><html><head><title>Onion Chicken</title>%s"
+            "</head><body>%s<article>%s</article>%s</body></html>"
+            % (head, noise, body, noise))
+
+
+def load_pages(directory=None, size=300_000):
+    pages = {}
+    for source in PROVIDERS:
+        path = os.path.join(directory, source + ".html") if directory else None
+        if path and os.path.isfile(path):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages[source] = f.read()
+        else:
+            pages[source] = generate_page(source, size)
+    return pages
@@ -0,0 +1,89 @@
+"""measure how much the skill costs at boot
+
+    python benchmarks/startup.py [--runs 5] [--output startup.json]
+
+every run happens in a fresh interpreter, reported numbers are medians in
+milliseconds, heavy_modules lists the scraping / http stack that got
+imported as a side effect (should be empty until the first request)"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("requests", "cloudscraper", "bs4", "aiohttp", "numpy", "sqlite3")
+
+PROBE = """
+import importlib.util, json, sys, time
+sys.path.insert(0, {root!r})
+t0 = time.perf_counter()
+import pyedaman
+t1 = time.perf_counter()
+client = pyedaman.PyEdaman()
+t2 = time.perf_counter()
+result = {{"import_pyedaman": (t1 - t0) * 1000,
+          "construct_client": (t2 - t1) * 1000,
+          "heavy_modules": [m for m in {heavy!r} if m in sys.modules]}}
+try:
+    spec = importlib.util.spec_from_file_location(
+        "skill_nutrients", {root!r} + "/__init__.py",
+        submodule_search_locations=[{root!r}])
+    skill = importlib.util.module_from_spec(spec)
+    sys.modules["skill_nutrients"] = skill
+    t3 = time.perf_counter()
+    spec.loader.exec_module(skill)
+    result["import_skill"] = (time.perf_counter() - t3) * 1000
+except ImportError as e:  # ovos not installed
+    result["import_skill"] = None
+print(json.dumps(result))
+"""
+
+
+def run_probe():
+    out = subprocess.run([sys.executable, "-c",
+                          PROBE.format(root=ROOT, heavy=HEAVY)],
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_time_breakdown():
+    """ cumulative -X importtime in ms for the slowest modules """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                          "import pyedaman"],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        modules.append((name.strip(), int(cumulative_us) / 1000))
+    modules.sort(key=lambda m: m[1], reverse=True)
+    return dict(modules[:10])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write json results to this file")
+    args = parser.parse_args()
+
+    runs = [run_probe() for _ in range(args.runs)]
+    report = {"runs": args.runs,
+              "python": sys.version.split()[0],
+              "heavy_modules": runs[-1]["heavy_modules"],
+              "slowest_imports": import_time_breakdown()}
+    for key in ("import_pyedaman", "construct_client", "import_skill"):
+        values = [r[key] for r in runs if r[key] is not None]
+        report[key + "_ms"] = statistics.median(values) if values else None
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
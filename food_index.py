@@ -0,0 +1,126 @@
+import difflib
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    from .pyedaman import TTLCache
+except ImportError:  # running from a checkout
+    from pyedaman import TTLCache
+
+
+class FoodIndex:
+    """ persistent sqlite index of foods already resolved by the api
+
+    parsed food-database entries are stored by foodId and normalized
+    label, PyEdaman.search_food answers from here when a query matches
+    with high enough confidence and only calls the api otherwise
+
+    a query is answered exactly as the api answered it, fuzzy label
+    matches only use entries for a single unit ("apple", not "3 apples")
+    so they never carry another query's quantity"""
+
+    def __init__(self, path=":memory:", min_confidence=0.9, max_age=None,
+                 candidates=25):
+        self.path = path
+        self.min_confidence = min_confidence
+        # seconds before an entry is considered stale, None keeps forever
+        self.max_age = max_age
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS foods (
+                food_id TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS foods_label ON foods (label);
+            CREATE TABLE IF NOT EXISTS answers (
+                query TEXT PRIMARY KEY,
+                parsed TEXT NOT NULL,
+                updated REAL NOT NULL);
+        """)
+        self._db.commit()
+
+    normalize = staticmethod(TTLCache.normalize)
+
+    def _fresh(self, updated):
+        return self.max_age is None or time.time() - updated < self.max_age
+
+    def add(self, query, parsed):
+        """ store the "parsed" entries the api returned for query """
+        now = time.time()
+        single, other = [], []
+        for p in parsed:
+            row = (p["food"]["foodId"],
+                   self.normalize(p["food"].get("label", "")),
+                   json.dumps(p), now)
+            (single if p.get("quantity") == 1 else other).append(row)
+        if not single and not other:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO foods VALUES (?, ?, ?, ?)", single)
+            # a single unit answer already stored wins over "3 apples"
+            self._db.executemany(
+                "INSERT OR IGNORE INTO foods VALUES (?, ?, ?, ?)", other)
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?)",
+                (self.normalize(query), json.dumps(parsed), now))
+            self._db.commit()
+
+    def get(self, food_id):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM foods WHERE food_id = ?",
+                                   (food_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(self, query, limit=5):
+        """ fuzzy match query against stored labels
+
+        returns a list of (confidence, parsed entry) best first, label
+        candidates share the query prefix so lookups stay on the index"""
+        query = self.normalize(query)
+        if not query:
+            return []
+        prefix = query[:3]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT label, data, updated FROM foods "
+                "WHERE label >= ? AND label < ? LIMIT ?",
+                (prefix, prefix + "\uffff", self.candidates)).fetchall()
+        scored = []
+        for label, data, updated in rows:
+            if not self._fresh(updated):
+                continue
+            parsed = json.loads(data)
+            if parsed.get("quantity") != 1:
+                continue
+            score = difflib.SequenceMatcher(None, query, label).ratio()
+            scored.append((score, parsed))
+        scored.sort(key=lambda s: s[0], reverse=True)
+        return scored[:limit]
+
+    def lookup(self, query):
+        """ parsed entries for query, or None if not confident enough """
+        norm = self.normalize(query)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT parsed, updated FROM answers WHERE query = ?",
+                (norm,)).fetchone()
+        if row and self._fresh(row[1]):
+            return json.loads(row[0])
+        matches = self.search(norm, limit=1)
+        if matches and matches[0][0] >= self.min_confidence:
+            return [matches[0][1]]
+        return None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
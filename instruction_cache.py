@@ -0,0 +1,74 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+CachedInstructions = namedtuple("CachedInstructions",
+                                ["steps", "etag", "last_modified", "checked"])
+
+
+class InstructionCache:
+    """ persistent sqlite cache of scraped recipe instructions
+
+    entries younger than max_age seconds are served without touching the
+    network, older ones are revalidated by Recipe.parse() with a
+    conditional request using the stored ETag / Last-Modified"""
+
+    def __init__(self, path=":memory:", max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS instructions (
+                url TEXT PRIMARY KEY,
+                steps TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked REAL NOT NULL)""")
+        self._db.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT steps, etag, last_modified, checked "
+                "FROM instructions WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return CachedInstructions(json.loads(row[0]), *row[1:])
+
+    def is_fresh(self, entry):
+        return time.time() - entry.checked < self.max_age
+
+    def put(self, url, steps, etag=None, last_modified=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO instructions VALUES (?, ?, ?, ?, ?)",
+                (url, json.dumps(steps), etag, last_modified, time.time()))
+            self._db.commit()
+
+    def touch(self, url):
+        """ mark an entry as just revalidated (304 Not Modified) """
+        with self._lock:
+            self._db.execute("UPDATE instructions SET checked = ? WHERE url = ?",
+                             (time.time(), url))
+            self._db.commit()
+
+    def validators(self, entry):
+        """ conditional request headers for a stale entry """
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM instructions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,162 @@
+import numpy as np
+
+try:
+    from .pyedaman import Nutrient
+except ImportError:  # running from a checkout
+    from pyedaman import Nutrient
+
+# fixed column order, (tag, label, unit) as reported by edamam
+NUTRIENTS = (
+    ("ENERC_KCAL", "Energy", "kcal"),
+    ("FAT", "Fat", "g"),
+    ("FASAT", "Saturated", "g"),
+    ("FATRN", "Trans", "g"),
+    ("FAMS", "Monounsaturated", "g"),
+    ("FAPU", "Polyunsaturated", "g"),
+    ("CHOCDF", "Carbs", "g"),
+    ("CHOCDF.net", "Carbohydrates (net)", "g"),
+    ("FIBTG", "Fiber", "g"),
+    ("SUGAR", "Sugars", "g"),
+    ("SUGAR.added", "Sugars, added", "g"),
+    ("PROCNT", "Protein", "g"),
+    ("CHOLE", "Cholesterol", "mg"),
+    ("NA", "Sodium", "mg"),
+    ("CA", "Calcium", "mg"),
+    ("MG", "Magnesium", "mg"),
+    ("K", "Potassium", "mg"),
+    ("FE", "Iron", "mg"),
+    ("ZN", "Zinc", "mg"),
+    ("P", "Phosphorus", "mg"),
+    ("VITA_RAE", "Vitamin A", "µg"),
+    ("VITC", "Vitamin C", "mg"),
+    ("THIA", "Thiamin (B1)", "mg"),
+    ("RIBF", "Riboflavin (B2)", "mg"),
+    ("NIA", "Niacin (B3)", "mg"),
+    ("VITB6A", "Vitamin B6", "mg"),
+    ("FOLDFE", "Folate equivalent (total)", "µg"),
+    ("FOLFD", "Folate (food)", "µg"),
+    ("FOLAC", "Folic acid", "µg"),
+    ("VITB12", "Vitamin B12", "µg"),
+    ("VITD", "Vitamin D", "µg"),
+    ("TOCPHA", "Vitamin E", "mg"),
+    ("VITK1", "Vitamin K", "µg"),
+    ("WATER", "Water", "g"),
+)
+NUTRIENT_TAGS = tuple(n[0] for n in NUTRIENTS)
+NUTRIENT_INDEX = {tag: idx for idx, tag in enumerate(NUTRIENT_TAGS)}
+
+
+def nutrient_vector(nutrients, out=None):
+    """ map nutrients onto the fixed NUTRIENT_TAGS column order
+
+    accepts a list of Nutrient objects or the raw api json, either
+    {tag: {"quantity": q}} or the food database {tag: q}, unknown tags
+    are ignored"""
+    vec = np.zeros(len(NUTRIENT_TAGS)) if out is None else out
+    if isinstance(nutrients, dict):
+        for tag, value in nutrients.items():
+            idx = NUTRIENT_INDEX.get(tag)
+            if idx is not None:
+                if isinstance(value, dict):
+                    value = value.get("quantity", 0)
+                vec[idx] = value
+    else:
+        for n in nutrients or []:
+            idx = NUTRIENT_INDEX.get(n.tag)
+            if idx is not None:
+                vec[idx] = n.quantity
+    return vec
+
+
+def _raw_section(item, section):
+    # read the still undecoded json when possible, building Nutrient
+    # objects only to throw them away is what this module avoids
+    try:
+        return getattr(item, "_" + section)
+    except AttributeError:
+        return getattr(item, section, None)
+
+
+def to_nutrients(vector, unit=None, skip_zero=True):
+    """ convert a vector back into a list of Nutrient objects
+
+    unit overrides the default unit, eg. "%" for daily values"""
+    nutrients = []
+    for (tag, label, default_unit), quantity in zip(NUTRIENTS, vector):
+        if skip_zero and not quantity:
+            continue
+        nutrients.append(Nutrient(tag, label=label, quantity=float(quantity),
+                                  unit=unit or default_unit))
+    return nutrients
+
+
+class NutrientTable:
+    """ nutrients of many items as one (items x NUTRIENT_TAGS) float array
+
+    sums, scaling and per serving values are vectorized over all rows
+    instead of looping over Nutrient objects"""
+
+    def __init__(self, matrix, names=None, yields=None):
+        self.matrix = np.asarray(matrix, dtype=float).reshape(
+            -1, len(NUTRIENT_TAGS))
+        rows = len(self.matrix)
+        self.names = list(names) if names is not None else [""] * rows
+        self.yields = np.ones(rows) if yields is None else \
+            np.asarray(yields, dtype=float)
+
+    @classmethod
+    def from_items(cls, items, section=None):
+        """ build a table from Ingredient, Recipe or Food objects
+
+        section defaults to totalNutrients, or nutrients for Food"""
+        items = list(items)
+        matrix = np.zeros((len(items), len(NUTRIENT_TAGS)))
+        names, yields = [], []
+        for row, item in zip(matrix, items):
+            sec = section or ("totalNutrients" if hasattr(item, "totalNutrients")
+                              else "nutrients")
+            nutrient_vector(_raw_section(item, sec), out=row)
+            names.append(str(item))
+            yields.append(getattr(item, "yields", 1) or 1)
+        return cls(matrix, names, yields)
+
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls(np.zeros((0, len(NUTRIENT_TAGS))))
+        return cls(np.vstack([t.matrix for t in tables]),
+                   [n for t in tables for n in t.names],
+                   np.concatenate([t.yields for t in tables]))
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def column(self, tag):
+        return self.matrix[:, NUTRIENT_INDEX[tag]]
+
+    @property
+    def calories(self):
+        return self.column("ENERC_KCAL")
+
+    def total(self):
+        """ summed vector over every row """
+        return self.matrix.sum(axis=0)
+
+    def scale(self, factors):
+        """ new table with each row multiplied by its factor (or one
+        factor for all rows), eg. portions eaten """
+        factors = np.asarray(factors, dtype=float)
+        if factors.ndim:
+            factors = factors[:, None]
+        return NutrientTable(self.matrix * factors, self.names, self.yields)
+
+    def per_serving(self):
+        """ new table with each row divided by its recipe yield """
+        return NutrientTable(self.matrix / self.yields[:, None],
+                             self.names, np.ones(len(self)))
+
+    def to_nutrients(self, row=None, unit=None):
+        """ Nutrient objects for one row, or the totals if row is None """
+        vector = self.total() if row is None else self.matrix[row]
+        return to_nutrients(vector, unit=unit)
@@ -1,9 +1,19 @@
+import codecs
+import io
 import json
 import logging
-
-import cloudscraper
-import requests
-from bs4 import BeautifulSoup
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from functools import partial
+from html.parser import HTMLParser
+from concurrent.futures import (CancelledError, Future, ThreadPoolExecutor,
+                                as_completed)
+from urllib.parse import urlparse
 
 logger = logging.getLogger("PyEdamam")
 
@@ -32,8 +42,383 @@ class InvalidNutrientsApiKey(InvalidKey):
     """ raised when nutrients api keys are invalid """
 
 
+class RateLimited(APIError):
+    """ raised when a request would wait longer than allowed for quota """
+
+
+class Metrics:
+    """ thread safe counters and latency samples for the hot paths
+
+    timings keep the last max_samples observations per name for
+    percentiles plus an all time count / sum, snapshot() returns plain
+    dicts and prometheus() the text exposition format"""
+
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._samples = {}
+        self._totals = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.max_samples)
+                self._totals[name] = [0, 0.0]
+            samples.append(seconds)
+            totals = self._totals[name]
+            totals[0] += 1
+            totals[1] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def percentile(self, name, p):
+        """ p in [0, 1] over the recent samples of name, None if unseen """
+        with self._lock:
+            samples = sorted(self._samples.get(name) or [])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {k: sorted(v) for k, v in self._samples.items()}
+            totals = {k: tuple(v) for k, v in self._totals.items()}
+        timings = {}
+        for name, values in samples.items():
+            count, total = totals[name]
+
+            def pct(p):
+                return values[min(len(values) - 1, int(p * len(values)))]
+
+            timings[name] = {"count": count, "sum": total,
+                             "p50": pct(0.5), "p95": pct(0.95),
+                             "p99": pct(0.99), "max": values[-1]}
+        return {"counters": counters, "timings": timings}
+
+    def prometheus(self, prefix="pyedaman"):
+        """ prometheus text exposition of snapshot() """
+
+        def metric(name):
+            return prefix + "_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            lines.append("# TYPE %s_total counter" % metric(name))
+            lines.append("%s_total %s" % (metric(name), value))
+        for name, t in sorted(snap["timings"].items()):
+            base = metric(name) + "_seconds"
+            lines.append("# TYPE %s summary" % base)
+            for q in ("0.5", "0.95", "0.99"):
+                key = "p" + q[2:].ljust(2, "0")
+                lines.append('%s{quantile="%s"} %.6f' % (base, q, t[key]))
+            lines.append("%s_sum %.6f" % (base, t["sum"]))
+            lines.append("%s_count %d" % (base, t["count"]))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+            self._totals.clear()
+
+
+class Transport:
+    """ how the client talks http
+
+    Edaman sends every api call through transport.request() and recipe
+    pages through scrape_transport.request(), swap them to mock, record
+    or load test the client. Responses must quack like requests.Response
+    (status_code, ok, headers, encoding, text, json(), iter_content(),
+    close())"""
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        raise NotImplementedError
+
+    def close(self):
+        """ release pooled connections """
+
+
+class RequestsTransport(Transport):
+    """ pooled keep-alive requests session shared by every endpoint """
+
+    def __init__(self, pool_size=10, max_retries=1, session=None):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self._session = session
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        # heavy http stack is only imported once a request is made
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size,
+                              max_retries=self.max_retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate",
+                                "Connection": "keep-alive"})
+        return session
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        return self.session.request(method, url, params=params, data=data,
+                                    headers=headers, timeout=timeout,
+                                    stream=stream)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class ScraperTransport(Transport):
+    """ one cloudscraper session per recipe site host
+
+    challenge cookies and connections are reused across recipes from the
+    same site"""
+
+    def __init__(self):
+        self._scrapers = {}
+        self._lock = threading.Lock()
+
+    def get_scraper(self, url):
+        host = urlparse(url).netloc.lower()
+        scraper = self._scrapers.get(host)
+        if scraper is None:
+            with self._lock:
+                scraper = self._scrapers.get(host)
+                if scraper is None:
+                    import cloudscraper
+                    scraper = self._scrapers[host] = \
+                        cloudscraper.create_scraper()
+        return scraper
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        return self.get_scraper(url).request(method, url, params=params,
+                                             data=data, headers=headers,
+                                             timeout=timeout, stream=stream)
+
+    def close(self):
+        for scraper in self._scrapers.values():
+            scraper.close()
+        self._scrapers = {}
+
+
+class TokenBucket:
+    """ thread safe token bucket refilled with rate tokens per second
+
+    reserve() takes a token right away, going into debt if needed, and
+    returns how long the caller must wait before spending it, so callers
+    queue in arrival order instead of failing"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def available(self):
+        """ tokens that could be taken right now, negative when in debt """
+        with self._lock:
+            return min(self.capacity, self._tokens + (time.monotonic() -
+                                                      self._updated) * self.rate)
+
+    def reserve(self, max_wait=None):
+        """ seconds to wait for a token, None if that exceeds max_wait """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class RateLimiter:
+    """ client side quota, one TokenBucket per api key
+
+    the defaults match the free edamam developer plans, 10 calls per
+    minute, bursts of up to burst calls are sent without waiting"""
+
+    def __init__(self, calls=10, period=60.0, burst=None, max_wait=None):
+        self.calls = calls
+        self.period = period
+        self.burst = calls if burst is None else burst
+        # None queues forever, otherwise RateLimited is raised
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(
+                    self.calls / self.period, self.burst)
+            return bucket
+
+    def reserve(self, key):
+        """ seconds the caller must wait before sending a request for key """
+        wait = self.bucket(key).reserve(self.max_wait)
+        if wait is None:
+            raise RateLimited("quota for %s exhausted" % key)
+        return wait
+
+    def available(self, key):
+        return self.bucket(key).available()
+
+    def acquire(self, key):
+        """ block until a request for key may be sent """
+        wait = self.reserve(key)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class Credential:
+    """ one app id / key pair and how it has been doing """
+    __slots__ = ("app_id", "app_key", "requests", "failures", "invalid",
+                 "cooldown_until")
+
+    def __init__(self, app_id, app_key):
+        self.app_id = app_id
+        self.app_key = app_key
+        self.requests = 0
+        self.failures = 0
+        # answered 401 last time it was used
+        self.invalid = False
+        # time.monotonic() before which the key is left alone
+        self.cooldown_until = 0.0
+
+    def __repr__(self):
+        return self.app_id
+
+
+class CredentialPool:
+    """ app id / key pairs usable for one endpoint
+
+    requests go to the ready key with the most quota left in the
+    RateLimiter, round robin when tied or without a limiter. keys
+    answering 429 rest for Retry-After (or cooldown) seconds, keys
+    answering 401 for invalid_cooldown seconds"""
+
+    def __init__(self, credentials, cooldown=60.0, invalid_cooldown=3600.0,
+                 max_wait=None):
+        self.credentials = [c if isinstance(c, Credential) else Credential(*c)
+                            for c in credentials]
+        if not self.credentials:
+            raise ValueError("a CredentialPool needs at least one key")
+        self.cooldown = cooldown
+        self.invalid_cooldown = invalid_cooldown
+        # longest wait for a cooling key before raising RateLimited
+        self.max_wait = max_wait
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _rotation(self):
+        return self.credentials[self._next:] + self.credentials[:self._next]
+
+    def acquire(self, rate_limiter=None, exclude=()):
+        """ (credential, seconds to wait before using it) """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [c for c in self._rotation() if c not in exclude] \
+                or self._rotation()
+            ready = [c for c in candidates if c.cooldown_until <= now]
+            if ready:
+                best = ready[0] if rate_limiter is None else max(
+                    ready, key=lambda c: rate_limiter.available(c.app_id))
+                wait = 0
+            else:
+                best = min(candidates, key=lambda c: c.cooldown_until)
+                # a rejected key gets sent anyway so the caller sees
+                # InvalidKey, a throttled one is waited for
+                wait = 0 if best.invalid else best.cooldown_until - now
+            self._next = (self.credentials.index(best) + 1) % \
+                len(self.credentials)
+            best.requests += 1
+        if self.max_wait is not None and wait > self.max_wait:
+            raise RateLimited("every key for this endpoint is cooling down")
+        return best, wait
+
+    def report(self, credential, status_code, retry_after=None):
+        """ record an answer, True if the key itself was the problem """
+        with self._lock:
+            now = time.monotonic()
+            if status_code == 401:
+                credential.failures += 1
+                credential.invalid = True
+                credential.cooldown_until = now + self.invalid_cooldown
+                return True
+            if status_code == 429:
+                try:
+                    rest = float(retry_after)
+                except (TypeError, ValueError):
+                    rest = self.cooldown
+                credential.failures += 1
+                credential.cooldown_until = now + rest
+                return True
+            if status_code < 400:
+                # the key works again, eg. a 401 that was fixed upstream
+                credential.invalid = False
+                credential.failures = 0
+                credential.cooldown_until = 0.0
+            return False
+
+    def ready(self, exclude=()):
+        """ keys not in exclude that can be used right away """
+        now = time.monotonic()
+        with self._lock:
+            return [c for c in self.credentials
+                    if c not in exclude and c.cooldown_until <= now]
+
+    def usage(self):
+        """ per key counters, app keys are never included """
+        now = time.monotonic()
+        with self._lock:
+            return [{"app_id": c.app_id, "requests": c.requests,
+                     "failures": c.failures, "invalid": c.invalid,
+                     "cooling": round(max(0.0, c.cooldown_until - now), 1)}
+                    for c in self.credentials]
+
+    def __len__(self):
+        return len(self.credentials)
+
+
 class Edaman:
     """ low level api returning raw json data"""
+    base_url = "https://api.edamam.com"
 
     def __init__(self,
                  # keys scrapped from web demos
@@ -42,7 +427,20 @@ class Edaman:
                  recipes_appid='eceecbfb',
                  recipes_appkey='83347a87348057d5ab183aade8106646',
                  food_appid="07d50733",
-                 food_appkey="80fcb49b500737827a9a23f7049653b9"
+                 food_appkey="80fcb49b500737827a9a23f7049653b9",
+                 timeout=(3.05, 10),
+                 pool_size=10,
+                 max_retries=1,
+                 session=None,
+                 instruction_cache=None,
+                 transport=None,
+                 scrape_transport=None,
+                 base_url=None,
+                 metrics=None,
+                 rate_limiter=None,
+                 nutrition_keys=None,
+                 recipes_keys=None,
+                 food_keys=None
                  ):
         self.nutrition_appid = nutrition_appid
         self.nutrition_appkey = nutrition_appkey
@@ -50,101 +448,1389 @@ class Edaman:
         self.recipes_appkey = recipes_appkey
         self.food_appid = food_appid
         self.food_appkey = food_appkey
-
-    def search_recipe(self, query="chicken"):
-        url = 'https://api.edamam.com/search?q=' + query + '&app_id=' + \
-              self.recipes_appid + '&app_key=' + \
-              self.recipes_appkey
-
-        r = requests.get(url)
-        if r.status_code == 401:
-            logger.error("invalid recipe api key")
-            raise InvalidRecipeApiKey
-        return r.json()
-
-    def search_nutrient(self, ingredients=None):
+        # endpoint -> CredentialPool, *_keys take a pool or (id, key) pairs
+        # and replace the single pair above
+        self.credentials = {}
+        for endpoint, keys, pair in (
+                ("nutrient", nutrition_keys, (nutrition_appid, nutrition_appkey)),
+                ("recipe", recipes_keys, (recipes_appid, recipes_appkey)),
+                ("food", food_keys, (food_appid, food_appkey))):
+            if keys is None:
+                keys = [pair]
+            if not isinstance(keys, CredentialPool):
+                keys = CredentialPool(keys)
+            self.credentials[endpoint] = keys
+        # (connect, read) seconds, a hung socket must never block forever
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        if transport is None:
+            transport = RequestsTransport(pool_size, max_retries, session)
+        self.transport = transport
+        if scrape_transport is None:
+            scrape_transport = ScraperTransport()
+        self.scrape_transport = scrape_transport
+        if base_url:
+            # eg. a local stand-in server
+            self.base_url = base_url.rstrip("/")
+        # optional persistent InstructionCache used by Recipe.parse()
+        self.instruction_cache = instruction_cache
+        # pass a shared Metrics to aggregate several clients
+        self.metrics = Metrics() if metrics is None else metrics
+        # optional RateLimiter, requests queue for their key's quota
+        self.rate_limiter = rate_limiter
+
+    def close(self):
+        """ release pooled connections """
+        self.transport.close()
+        self.scrape_transport.close()
+
+    # request building and response validation are shared with the
+    # asyncio client, only the transport differs
+    def _recipe_request(self, query, start=None, end=None):
+        url = self.base_url + '/search'
+        params = {"q": query}
+        if start is not None:
+            params["from"] = start
+        if end is not None:
+            params["to"] = end
+        return url, params
+
+    def _nutrient_request(self, ingredients):
         ingredients = ingredients or []
         if isinstance(ingredients, str):
             ingredients = [ingredients]
+        url = self.base_url + '/api/nutrition-details'
+        return url, {}, {"ingr": list(ingredients)}
+
+    def _food_request(self, query):
+        url = self.base_url + '/api/food-database/parser'
+        params = {"nutrition-type": "logging",
+                  "ingr": query}
+        return url, params
+
+    @staticmethod
+    def _check_recipe_status(status_code):
+        if status_code == 401:
+            logger.error("invalid recipe api key")
+            raise InvalidRecipeApiKey
 
-        url = 'https://api.edamam.com/api/nutrition-details?app_id={id}' \
-              '&app_key={key}'.format(id=self.nutrition_appid,
-                                      key=self.nutrition_appkey)
-
-        data = {"ingr": ingredients}
-        r = requests.post(url,
-                          headers={"Content-Type": "application/json"},
-                          data=json.dumps(data))
-
-        if r.status_code == 401:
+    @staticmethod
+    def _check_nutrient_status(status_code):
+        if status_code == 401:
             logger.error("invalid nutrients api key")
             raise InvalidNutrientsApiKey
 
-        data = r.json()
+    @staticmethod
+    def _check_food_status(status_code):
+        if status_code == 401:
+            logger.error("invalid food api key")
+            raise InvalidFoodApiKey
+
+    # nutrition-details answers 555 to queries it can't understand
+    LOW_QUALITY_STATUS = 555
+
+    def _check_http(self, status_code, allowed=()):
+        """ raise for non-2xx answers, their bodies are never data """
+        if status_code == 429:
+            # _send only gets here when no other key was ready
+            logger.error("api quota exceeded for every key")
+            raise RateLimited("http 429, no api key with quota left")
+        if status_code >= 400 and status_code not in allowed:
+            logger.error("api request failed with http %s", status_code)
+            raise APIError("http %s" % status_code)
+
+    def _check_nutrient_data(self, data):
         if data.get("error"):
             if data["error"] == "low_quality":
+                self.metrics.incr("errors.low_quality")
                 logger.error("could not understand query")
                 raise LowQualityQuery
             else:
+                self.metrics.incr("errors.api")
                 raise APIError
         return data
 
-    def search_food(self, query="pizza"):
-        url = 'https://api.edamam.com/api/food-database/parser?nutrition' \
-              '-type=logging&ingr={query}&app_id={id}&app_key={key}' \
-            .format(id=self.food_appid, key=self.food_appkey, query=query)
-
-        r = requests.get(url)
-        if r.status_code == 401:
-            logger.error("invalid food api key")
-            raise InvalidFoodApiKey
-
-        r = r.json()
-        if r.get("status") == "error":
-            error = r.get("message")
+    def _check_food_data(self, data):
+        if data.get("status") == "error":
+            self.metrics.incr("errors.api")
+            error = data.get("message")
             if not error:
                 error = "Api request failed"
             logger.error(error)
             raise APIError
-        return r
+        return data
+
+    def _count_status(self, endpoint, status_code):
+        self.metrics.incr("api.%s.requests" % endpoint)
+        if status_code == 401:
+            self.metrics.incr("errors.invalid_key")
+        elif status_code >= 400:
+            self.metrics.incr("errors.http_%s" % status_code)
+
+    def _reserve(self, key):
+        """ seconds to wait for quota before sending with key """
+        if self.rate_limiter is None:
+            return 0
+        try:
+            wait = self.rate_limiter.reserve(key)
+        except RateLimited:
+            self.metrics.incr("errors.rate_limited")
+            raise
+        if wait:
+            self.metrics.incr("ratelimit.queued")
+            self.metrics.observe("ratelimit.wait", wait)
+        return wait
+
+    def _credential(self, endpoint, tried=()):
+        """ (credential, seconds to wait) for the next request to endpoint """
+        credential, wait = self.credentials[endpoint].acquire(
+            self.rate_limiter, tried)
+        return credential, max(wait, self._reserve(credential.app_id))
+
+    def _keyed(self, params, credential):
+        return dict(params or {}, app_id=credential.app_id,
+                    app_key=credential.app_key)
+
+    def _retry_key(self, endpoint, credential, status_code, retry_after,
+                   tried):
+        """ True if another key should be tried after this answer """
+        pool = self.credentials[endpoint]
+        if not pool.report(credential, status_code, retry_after):
+            return False
+        self.metrics.incr("keys.cooldown")
+        tried.append(credential)
+        if not pool.ready(tried):
+            return False
+        self.metrics.incr("keys.failover")
+        return True
+
+    def _send(self, endpoint, method, url, params=None, **kwargs):
+        """ timed transport call, counts requests and error categories
+
+        uses the endpoint's best key, a 401 / 429 answer cools that key
+        down and the request is repeated with another ready one"""
+        tried = []
+        while True:
+            credential, wait = self._credential(endpoint, tried)
+            if wait:
+                time.sleep(wait)
+            try:
+                with self.metrics.timer("api." + endpoint):
+                    r = self.transport.request(
+                        method, url, params=self._keyed(params, credential),
+                        timeout=self.timeout, **kwargs)
+            except Exception:
+                self.metrics.incr("errors.transport")
+                raise
+            self._count_status(endpoint, r.status_code)
+            if not self._retry_key(endpoint, credential, r.status_code,
+                                   r.headers.get("Retry-After"), tried):
+                return r
+            r.close()
+
+    def _has_quota(self, endpoint):
+        """ True if a request to endpoint would be sent without queueing """
+        if self.rate_limiter is None:
+            return True
+        return any(self.rate_limiter.available(c.app_id) >= 1
+                   for c in self.credentials[endpoint].ready())
+
+    def key_usage(self):
+        """ endpoint -> per key usage, with the quota left if rate limited """
+        usage = {}
+        for endpoint, pool in self.credentials.items():
+            usage[endpoint] = pool.usage()
+            if self.rate_limiter is not None:
+                for key in usage[endpoint]:
+                    key["remaining"] = round(self.rate_limiter.available(
+                        key["app_id"]), 1)
+        return usage
+
+    def _json(self, endpoint, r):
+        with self.metrics.timer("decode." + endpoint):
+            return r.json()
+
+    def search_recipe(self, query="chicken", start=None, end=None):
+        url, params = self._recipe_request(query, start, end)
+        r = self._send("recipe", "GET", url, params=params)
+        self._check_recipe_status(r.status_code)
+        self._check_http(r.status_code)
+        return self._json("recipe", r)
+
+    def stream_recipe_hits(self, query="chicken", start=None, end=None,
+                           chunk_size=8192):
+        """ yield raw recipe hits while the response is still downloading
+
+        closing the generator early closes the connection, so callers
+        that only need the first hit never download the rest"""
+        url, params = self._recipe_request(query, start, end)
+        r = self._send("recipe", "GET", url, params=params, stream=True)
+        try:
+            self._check_recipe_status(r.status_code)
+            # an error body has no hits, don't pass it off as a last page
+            self._check_http(r.status_code)
+            for hit in iter_json_array(r.iter_content(chunk_size), "hits"):
+                self.metrics.incr("api.recipe.hits")
+                yield hit
+        finally:
+            r.close()
+
+    def search_nutrient(self, ingredients=None):
+        url, params, data = self._nutrient_request(ingredients)
+        r = self._send("nutrient", "POST", url, params=params,
+                       headers={"Content-Type": "application/json"},
+                       data=json.dumps(data))
+        self._check_nutrient_status(r.status_code)
+        self._check_http(r.status_code, (self.LOW_QUALITY_STATUS,))
+        return self._check_nutrient_data(self._json("nutrient", r))
+
+    def search_food(self, query="pizza"):
+        url, params = self._food_request(query)
+        r = self._send("food", "GET", url, params=params)
+        self._check_food_status(r.status_code)
+        self._check_http(r.status_code)
+        return self._check_food_data(self._json("food", r))
+
+
+def iter_json_array(chunks, key):
+    """ incrementally yield the items of the array stored under key
+
+    chunks is any iterable of bytes, each item is decoded and yielded as
+    soon as its closing bracket arrives"""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    marker = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    chunks = iter(chunks)
+    buf = ""
+    pos = None
+    eof = False
+    while True:
+        if pos is None:
+            match = marker.search(buf)
+            if match:
+                pos = match.end()
+                continue
+        else:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                if buf[pos] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield item
+                    buf, pos = buf[end:], 0
+                    continue
+        if eof:
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf += text.decode(b"", final=True)
+        else:
+            buf += text.decode(chunk)
+
+
+# quantity parsing, "two large apples" and "1 large apple" are answered
+# from the same cached base portion
+# alias -> (canonical unit, amount of canonical unit per alias)
+UNITS = {}
+for _unit, _factor, _aliases in (
+        ("g", 1, ("g", "gr", "gram", "grams", "gramme", "grammes")),
+        ("g", 1000, ("kg", "kilo", "kilos", "kilogram", "kilograms")),
+        ("g", 0.001, ("mg", "milligram", "milligrams")),
+        ("g", 28.349523125, ("oz", "ounce", "ounces")),
+        ("g", 453.59237, ("lb", "lbs", "pound", "pounds")),
+        ("ml", 1, ("ml", "milliliter", "milliliters", "millilitre",
+                   "millilitres")),
+        ("ml", 10, ("cl", "centiliter", "centiliters", "centilitre",
+                    "centilitres")),
+        ("ml", 1000, ("l", "liter", "liters", "litre", "litres")),
+        ("cup", 1, ("cup", "cups")),
+        ("tbsp", 1, ("tbsp", "tablespoon", "tablespoons")),
+        ("tsp", 1, ("tsp", "teaspoon", "teaspoons")),
+        ("slice", 1, ("slice", "slices")),
+        ("piece", 1, ("piece", "pieces")),
+        ("clove", 1, ("clove", "cloves")),
+        ("can", 1, ("can", "cans")),
+        ("glass", 1, ("glass", "glasses")),
+        ("serving", 1, ("serving", "servings")),
+        ("small", 1, ("small",)),
+        ("medium", 1, ("medium",)),
+        ("large", 1, ("large", "big"))):
+    for _alias in _aliases:
+        UNITS[_alias] = (_unit, _factor)
+# nutrition is cached per 100 g / ml, per 1 of anything else
+BASE_PORTIONS = {"g": 100, "ml": 100}
+# units counting whole items, "2 large apples" -> "1 large apple"
+_SIZES = ("small", "medium", "large")
+
+_NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3,
+                 "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+                 "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+                 "half": 0.5, "quarter": 0.25, "dozen": 12}
+_FRACTIONS = {"\u00bd": 0.5, "\u2153": 1 / 3, "\u2154": 2 / 3,
+              "\u00bc": 0.25, "\u00be": 0.75}
+_NUMBER = re.compile(r"(\d+(?:[.,]\d+)?)?([\u00bd\u2153\u2154\u00bc\u00be])?$")
+_FRACTION = re.compile(r"(\d+)/(\d+)$")
+# several foods in one query can't be scaled as one
+_COMPOUND = re.compile(r",|;|\+|&|\b(?:and|with|plus)\b")
+
+
+def _parse_amount(token):
+    if token in _NUMBER_WORDS:
+        return _NUMBER_WORDS[token]
+    match = _FRACTION.match(token)
+    if match:
+        if int(match.group(2)) == 0:
+            return None
+        return int(match.group(1)) / int(match.group(2))
+    match = _NUMBER.match(token)
+    if match and any(match.groups()):
+        value = float(match.group(1).replace(",", ".")) \
+            if match.group(1) else 0
+        return value + _FRACTIONS.get(match.group(2), 0)
+    return None
+
+
+def _singular(word):
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+class Quantity(namedtuple("Quantity", ["amount", "unit", "food"])):
+    """ "<amount> [unit] <food>" query, amount is in the canonical unit,
+    unit is None for plain counts like "2 apples" """
+    __slots__ = ()
+
+    @property
+    def base(self):
+        """ query for the base portion nutrition is cached for """
+        portion = BASE_PORTIONS.get(self.unit, 1)
+        if self.unit is None:
+            return "%s %s" % (portion, self.food)
+        return "%s %s %s" % (portion, self.unit, self.food)
+
+    @property
+    def factor(self):
+        """ this quantity as a multiple of the base portion """
+        return self.amount / BASE_PORTIONS.get(self.unit, 1)
+
+
+def parse_quantity(query):
+    """ Quantity for queries like "two large apples" or "200g of rice",
+    None when there is no leading amount or several foods are named """
+    query = " ".join(str(query).lower().split())
+    if _COMPOUND.search(query):
+        return None
+    # "200g" -> "200 g"
+    tokens = re.sub(r"^([\d.,/]+)([a-z]+)\b", r"\1 \2", query).split()
+    if not tokens:
+        return None
+    amount = _parse_amount(tokens[0])
+    if amount is None:
+        return None
+    idx = 1
+    if idx < len(tokens):
+        nxt = _parse_amount(tokens[idx])
+        if nxt is not None and tokens[0] in ("a", "an"):
+            # "a half cup", "a dozen eggs"
+            amount, idx = nxt, idx + 1
+        elif tokens[idx] == "dozen":
+            amount, idx = amount * 12, idx + 1
+        elif nxt is not None and nxt < 1 and amount == int(amount):
+            # "1 1/2 cups"
+            amount, idx = amount + nxt, idx + 1
+    if idx < len(tokens) and tokens[idx] == "of":
+        idx += 1
+    unit = None
+    if idx < len(tokens) and tokens[idx] in UNITS:
+        unit, per_unit = UNITS[tokens[idx]]
+        amount, idx = amount * per_unit, idx + 1
+    while idx < len(tokens) and tokens[idx] in ("of", "a", "an", "the"):
+        idx += 1
+    food = tokens[idx:]
+    if not food or amount <= 0 or _parse_amount(food[0]) is not None:
+        return None
+    if unit is None or unit in _SIZES:
+        food[-1] = _singular(food[-1])
+    return Quantity(amount, unit, " ".join(food))
+
+
+def scale_nutrition(data, factor):
+    """ nutrition-details json for factor times the analyzed portion
+
+    the per ingredient breakdown is left as analyzed"""
+    scaled = dict(data)
+    for section in ("totalNutrients", "totalDaily", "totalNutrientsKCal"):
+        nutrients = data.get(section)
+        if isinstance(nutrients, dict):
+            scaled[section] = {
+                tag: dict(n, quantity=n.get("quantity", 0) * factor)
+                for tag, n in nutrients.items()}
+    scaled["totalWeight"] = data.get("totalWeight", 0) * factor
+    scaled["calories"] = round(data.get("calories", 0) * factor)
+    return scaled
+
+
+_MISSING = object()
+
+
+class _Flight:
+    """ outcome of an in-flight call """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.done = False
+        # stays _MISSING when the leader gave up without an answer
+        self.result = _MISSING
+        self.error = None
+
+    def finish(self, result=_MISSING, error=None):
+        with self._cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """ the leader's result, _MISSING if it gave up or timed out """
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, timeout)
+            if self.error is not None:
+                raise self.error
+            return self.result
+
+
+class _SharedStream:
+    """ one iterator read by several callers, each at its own pace
+
+    whoever first needs the next item pulls it from source, the others
+    get it from memory, so nobody waits on how fast another caller
+    iterates. the source is closed as soon as every reader left"""
+
+    def __init__(self, source, finished):
+        self._source = source
+        # called once when the stream ends, completes or not
+        self._finished = finished
+        self.items = []
+        self.done = False
+        self.error = None
+        # every reader left before the end, the items are incomplete
+        self.abandoned = False
+        self._readers = 0
+        self._lock = threading.Lock()
+        self._pull = threading.Lock()
+
+    def join(self):
+        """ register a reader, False if the stream was already abandoned """
+        with self._lock:
+            if self.abandoned:
+                return False
+            self._readers += 1
+            return True
+
+    def read(self):
+        """ yield every item of a joined stream """
+        idx = 0
+        try:
+            while True:
+                item = self._get(idx)
+                if item is _MISSING:
+                    return
+                idx += 1
+                yield item
+        finally:
+            self._leave()
+
+    def _get(self, idx):
+        while True:
+            with self._lock:
+                if idx < len(self.items):
+                    return self.items[idx]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return _MISSING
+            with self._pull:
+                with self._lock:
+                    if idx < len(self.items) or self.done:
+                        continue
+                try:
+                    item = next(self._source)
+                except StopIteration:
+                    self._end()
+                    continue
+                except Exception as e:
+                    self._end(e)
+                    raise
+                with self._lock:
+                    self.items.append(item)
+
+    def _end(self, error=None, abandoned=False):
+        with self._lock:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self.abandoned = abandoned
+        self._finished()
+
+    def _leave(self):
+        with self._lock:
+            self._readers -= 1
+            if self._readers or self.done:
+                return
+        self._source.close()
+        self._end(abandoned=True)
+
+
+class SingleFlight:
+    """ coalesces concurrent identical calls
+
+    the first caller of a key runs the call, callers arriving while it is
+    in flight wait and share its result or exception instead of sending
+    their own request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        # key -> _SharedStream, see share()
+        self._streams = {}
+
+    def join(self, key):
+        """ (flight, leader), the leader must finish(key, ...) the flight """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key, result=_MISSING, error=None):
+        """ publish the leader's outcome, no result lets waiters retry """
+        with self._lock:
+            flight = self._flights.pop(key)
+        flight.finish(result, error)
+
+    def share(self, key, source):
+        """ (items, leader) reading one source() iterator per key
+
+        items is a generator, identical concurrent readers share the
+        source while it runs"""
+        with self._lock:
+            stream = self._streams.get(key)
+            leader = stream is None or not stream.join()
+            if leader:
+                stream = _SharedStream(source(),
+                                       lambda: self._unshare(key, stream))
+                stream.join()
+                self._streams[key] = stream
+        return stream.read(), leader
+
+    def _unshare(self, key, stream):
+        with self._lock:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+
+    def do(self, key, func, *args):
+        """ (func(*args), shared) running func once per concurrent key """
+        flight, leader = self.join(key)
+        if not leader:
+            result = flight.wait()
+            if result is not _MISSING:
+                return result, True
+            # the leader was interrupted, don't inherit that
+            return func(*args), False
+        result, error = _MISSING, None
+        try:
+            result = func(*args)
+            return result, False
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.finish(key, result, error)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class TTLCache:
+    """ thread safe, bounded LRU cache whose entries expire after ttl seconds """
+
+    def __init__(self, maxsize=512, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        if isinstance(query, (list, tuple)):
+            return tuple(TTLCache.normalize(q) for q in query)
+        return " ".join(str(query).lower().split())
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InstructionPrefetcher:
+    """ scrapes recipe instructions in the background
+
+    PyEdaman.search_recipe submits its first top_k Recipes, a later
+    Recipe.parse() returns the finished steps or waits on the running
+    scrape instead of starting its own. at most max_workers pages are
+    fetched at once and the steps of the max_entries most recently
+    submitted urls are kept, older entries are dropped and cancelled if
+    they haven't started yet"""
+
+    def __init__(self, top_k=2, max_workers=2, max_entries=32):
+        self.top_k = top_k
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # url -> Future of the steps, least recently submitted first
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, recipe):
+        """ Future of recipe's instruction steps, shared per url """
+        with self._lock:
+            future = self._futures.get(recipe.url)
+            if future is not None and not future.cancelled():
+                self._futures.move_to_end(recipe.url)
+                return future
+            future = self._executor.submit(recipe._scrape)
+            self._futures[recipe.url] = future
+            while len(self._futures) > self.max_entries:
+                _, old = self._futures.popitem(last=False)
+                old.cancel()
+        return future
+
+    def get(self, url):
+        """ Future for url, None if it was never submitted or cancelled """
+        with self._lock:
+            future = self._futures.get(url)
+        if future is None or future.cancelled():
+            return None
+        return future
+
+    def cancel(self, url=None):
+        """ forget url, or everything, cancelling scrapes not yet started """
+        with self._lock:
+            if url is None:
+                futures = list(self._futures.values())
+                self._futures.clear()
+            else:
+                futures = [f for f in [self._futures.pop(url, None)] if f]
+        for future in futures:
+            future.cancel()
+
+    def close(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __len__(self):
+        return len(self._futures)
 
 
 class PyEdaman(Edaman):
     """ High level api generating data objects"""
 
-    def search_recipe(self, query):
-        data = super().search_recipe(query)
-        hits = data["hits"]
-        for hit in hits:
-            data = hit["recipe"]
-            data["yields"] = data["yield"]
-            data.pop("yield")
-            data["ingredient_names"] = data["ingredientLines"]
-            data.pop("ingredientLines")
-            data["share_url"] = data["shareAs"]
-            data.pop("shareAs")
-            yield Recipe(edamam=self, **data)
+    def __init__(self, *args, cache_size=512, cache_ttl=3600,
+                 food_index=None, coalesce=True, hedge_after=1.0,
+                 scale_portions=True, recipe_index=None, prefetcher=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        # cache_size=0 disables caching
+        self.cache = TTLCache(cache_size, cache_ttl) if cache_size else None
+        # identical concurrent requests share one api call
+        self.inflight = SingleFlight() if coalesce else None
+        # optional persistent FoodIndex consulted before the food api
+        self.food_index = food_index
+        # optional persistent RecipeIndex consulted before the recipe api
+        self.recipe_index = recipe_index
+        # hedge delay in seconds until an endpoint has latency samples
+        self.hedge_after = hedge_after
+        # answer "2 large apples" by scaling the cached "1 large apple"
+        self.scale_portions = scale_portions
+        # optional InstructionPrefetcher, the owner closes it
+        self.prefetcher = prefetcher
+
+    def _cached(self, endpoint, query, fetch, coalesce=True):
+        """ return raw json for query, only hitting the api on a cache miss
+
+        cached data is shared, callers must not mutate it, coalesce=False
+        sends a new request even if an identical one is in flight"""
+        key = (endpoint, TTLCache.normalize(query))
+        if self.cache is not None:
+            data = self.cache.get(key, _MISSING)
+            if data is not _MISSING:
+                self.metrics.incr("cache.%s.hit" % endpoint)
+                return data
+            self.metrics.incr("cache.%s.miss" % endpoint)
+        if self.inflight is None or not coalesce:
+            return self._fetch(key, fetch, query)
+        data, shared = self.inflight.do(key, self._fetch, key, fetch, query)
+        if shared:
+            self.metrics.incr("coalesced.%s" % endpoint)
+        return data
 
-    def search_nutrient(self, ingredients=None):
+    def _fetch(self, key, fetch, query):
+        data = fetch(query)
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data
+
+    def _recipe_page(self, query, start, end, coalesce=True):
+        """ raw hits in [start, end), streamed unless already cached
+
+        concurrent callers of the same page share one download, each
+        pulls the hits it needs itself so nobody waits on how fast
+        another caller iterates, and the download stops once all of
+        them stopped reading"""
+        key = ("recipe", TTLCache.normalize(query), start, end)
+        if self.cache is not None:
+            hits = self.cache.get(key, _MISSING)
+            if hits is not _MISSING:
+                self.metrics.incr("cache.recipe.hit")
+                yield from hits
+                return
+            self.metrics.incr("cache.recipe.miss")
+        if self.inflight is None or not coalesce:
+            yield from self._page_source(key, query, start, end)
+            return
+        hits, leader = self.inflight.share(
+            key, lambda: self._page_source(key, query, start, end))
+        if not leader:
+            self.metrics.incr("coalesced.recipe")
+        yield from hits
+
+    def _page_source(self, key, query, start, end):
+        hits = []
+        stream = self.stream_recipe_hits(query, start, end)
+        try:
+            for hit in stream:
+                hits.append(hit)
+                if len(hits) >= end - start:
+                    # a full page can't grow, publish it before the
+                    # caller stops pulling
+                    self._page_done(key, hits)
+                    yield hit
+                    return
+                yield hit
+            self._page_done(key, hits)
+        finally:
+            stream.close()
+
+    def _page_done(self, key, hits):
+        # only complete pages are cached
+        if self.cache is not None:
+            self.cache.put(key, hits)
+        if self.recipe_index is not None and hits:
+            self.recipe_index.add(hits)
+
+    def search_recipe(self, query, page_size=10, max_results=100,
+                      prefetch=False, coalesce=True):
+        """ lazily yield Recipe objects, fetching pages on demand
+
+        the first Recipe is yielded before its page finished downloading,
+        prefetch=True downloads the next page in the background while
+        the current one is consumed
+
+        with a recipe_index, queries it can answer with enough fresh
+        recipes never reach the api, with a prefetcher the instructions
+        of the first recipes are scraped in the background"""
+        if self.recipe_index is not None:
+            hits = self.recipe_index.lookup(
+                query, max_results if max_results is not None else page_size)
+            self.metrics.incr("recipe_index.%s" %
+                              ("miss" if hits is None else "hit"))
+            if hits is not None:
+                for rank, hit in enumerate(hits):
+                    yield self._prefetch(self._make_recipe(hit), rank)
+                return
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        upcoming = None
+        start = 0
+        try:
+            while max_results is None or start < max_results:
+                end = start + page_size
+                if max_results is not None:
+                    end = min(end, max_results)
+                if upcoming is not None:
+                    hits = upcoming.result()
+                else:
+                    hits = self._recipe_page(query, start, end, coalesce)
+                if pool is not None:
+                    nxt = end + page_size
+                    if max_results is not None:
+                        nxt = min(nxt, max_results)
+                    upcoming = pool.submit(
+                        lambda s, e: list(self._recipe_page(query, s, e,
+                                                            coalesce)),
+                        end, nxt) if nxt > end else None
+
+                count = 0
+                for hit in hits:
+                    if count >= end - start:
+                        break
+                    count += 1
+                    yield self._prefetch(self._make_recipe(hit),
+                                         start + count - 1)
+                if count < end - start:
+                    break  # last page
+                start = end
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch(self, recipe, rank):
+        """ start scraping the instructions of the top ranked recipes """
+        if self.prefetcher is not None and rank < self.prefetcher.top_k \
+                and recipe.url:
+            self.prefetcher.submit(recipe)
+        return recipe
+
+    # json -> data objects, shared with the asyncio client
+    def _make_recipe(self, hit, edamam=None):
+        with self.metrics.timer("construct.recipe"):
+            data = dict(hit["recipe"])
+            data["yields"] = data.pop("yield")
+            data["ingredient_names"] = data.pop("ingredientLines")
+            data["share_url"] = data.pop("shareAs")
+            return Recipe(edamam=edamam or self, **data)
+
+    def _make_ingredient(self, data, name):
+        with self.metrics.timer("construct.ingredient"):
+            data = dict(data)
+            data["yields"] = data.pop("yield")
+            return Ingredient(name=name, **data)
+
+    def _make_food(self, parsed):
+        with self.metrics.timer("construct.food"):
+            return Food(measure=parsed["measure"],
+                        quantity=parsed["quantity"],
+                        **parsed["food"])
+
+    def _portion(self, ingredients):
+        """ Quantity to analyze ingredients as a scaled base portion """
+        if not self.scale_portions or not isinstance(ingredients, str):
+            return None
+        return parse_quantity(ingredients)
+
+    def _scaled(self, data, quantity):
+        if quantity is None or quantity.factor == 1:
+            return data
+        self.metrics.incr("portion.scaled")
+        return scale_nutrition(data, quantity.factor)
+
+    def _analyze(self, ingredients, name, coalesce=True):
+        quantity = self._portion(ingredients)
+        query = ingredients if quantity is None else quantity.base
+        data = self._cached("nutrient", query, super().search_nutrient,
+                            coalesce)
+        return self._make_ingredient(self._scaled(data, quantity), name)
+
+    def search_nutrient(self, ingredients=None, batch=False, max_workers=1,
+                        coalesce=True):
+        """ yield an Ingredient per entry in ingredients
+
+        batch=True sends a single request and yields one Ingredient with
+        the aggregate totals of all entries
+
+        max_workers > 1 analyzes entries concurrently and yields them in
+        completion order instead of input order"""
         ingredients = ingredients or []
         if isinstance(ingredients, str):
             ingredients = [ingredients]
-        for ing in ingredients:
-            data = super().search_nutrient(ing)
-            data["yields"] = data["yield"]
-            data.pop("yield")
-            yield Ingredient(name=ing, **data)
-
-    def search_food(self, query):
-        data = super().search_food(query)
+        if not ingredients:
+            return
+        if batch:
+            yield self._analyze(list(ingredients), ", ".join(ingredients),
+                                coalesce)
+        elif max_workers > 1 and len(ingredients) > 1:
+            pool = ThreadPoolExecutor(
+                max_workers=min(max_workers, len(ingredients)))
+            try:
+                futures = [pool.submit(self._analyze, ing, ing, coalesce)
+                           for ing in ingredients]
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            for ing in ingredients:
+                yield self._analyze(ing, ing, coalesce)
+
+    def search_food(self, query, coalesce=True):
+        if self.food_index is not None:
+            parsed = self.food_index.lookup(query)
+            self.metrics.incr("food_index.%s" % ("hit" if parsed else "miss"))
+            if parsed:
+                for food in parsed:
+                    yield self._make_food(food)
+                return
+        data = self._cached("food", query, super().search_food, coalesce)
+        if self.food_index is not None and data["parsed"]:
+            self.food_index.add(query, data["parsed"])
         for food in data["parsed"]:
-            yield Food(measure=food["measure"],
-                       quantity=food["quantity"],
-                       **food["food"])
+            yield self._make_food(food)
+
+    def iter_meal_log(self, lines, max_workers=8):
+        """ yield (line, Ingredient, error) for each distinct meal log line
+
+        repeated lines are analyzed once, results stream out in
+        completion order while at most max_workers requests run, error
+        is None unless that line failed and then Ingredient is None"""
+        unique = OrderedDict()
+        for line in lines:
+            key = TTLCache.normalize(line)
+            if key and key not in unique:
+                unique[key] = line.strip()
+        if not unique:
+            return
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(unique)))
+        try:
+            futures = {pool.submit(self._analyze, line, line): line
+                       for line in unique.values()}
+            for future in as_completed(futures):
+                line = futures[future]
+                try:
+                    yield line, future.result(), None
+                except Exception as e:
+                    # one bad line must not sink the whole day
+                    self.metrics.incr("meal_log.errors")
+                    yield line, None, e
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def analyze_meal_log(self, lines, max_workers=8):
+        """ MealLog with every line of a meal log analyzed """
+        log = MealLog(lines)
+        for line, ingredient, error in self.iter_meal_log(log.lines,
+                                                          max_workers):
+            log.add(line, ingredient, error)
+        return log
+
+    def hedge_delay(self, endpoint):
+        """ seconds after which a request to endpoint counts as slow,
+        the recent p95 of its latency """
+        p95 = self.metrics.percentile("api." + endpoint, 0.95)
+        return self.hedge_after if p95 is None else p95
+
+    def submit_hedged(self, executor, endpoint, primary, backup, delay=None):
+        """ future of primary(), hedged with backup() when slow
+
+        backup is submitted to executor if primary has not finished after
+        delay seconds (hedge_delay(endpoint) by default), the future
+        resolves to whichever succeeds first and only fails once every
+        started attempt failed. backup should not join primary's
+        in-flight request, ie. pass coalesce=False
+
+        no hedge is sent while the rate limiter has no quota left, primary
+        is then most likely slow because it is queued, not the api"""
+        if delay is None:
+            delay = self.hedge_delay(endpoint)
+        result = Future()
+        attempts = []
+        # settling the result cancels the other attempts, whose callbacks
+        # then run on this same thread
+        lock = threading.RLock()
+
+        def settle(future):
+            with lock:
+                if result.done():
+                    return
+                # the caller may cancel result from another thread, claim
+                # it before settling
+                if not future.cancelled() and future.exception() is None:
+                    if future is not attempts[0]:
+                        self.metrics.incr("hedge.%s.won" % endpoint)
+                    if result.set_running_or_notify_cancel():
+                        result.set_result(future.result())
+                elif all(f.done() for f in attempts):
+                    # a failed primary is not retried, only raced
+                    if result.set_running_or_notify_cancel():
+                        result.set_exception(
+                            CancelledError() if future.cancelled()
+                            else future.exception())
+
+        def hedge():
+            with lock:
+                if result.done():
+                    return
+                if not self._has_quota(endpoint):
+                    self.metrics.incr("hedge.%s.skipped" % endpoint)
+                    return
+                try:
+                    attempt = executor.submit(backup)
+                except RuntimeError:  # executor shut down
+                    return
+                self.metrics.incr("hedge.%s.sent" % endpoint)
+                attempts.append(attempt)
+            attempt.add_done_callback(settle)
+
+        def cancel(future):
+            timer.cancel()
+            with lock:
+                pending = list(attempts)
+            for attempt in pending:
+                attempt.cancel()
+
+        timer = threading.Timer(delay, hedge)
+        timer.daemon = True
+        attempts.append(executor.submit(primary))
+        timer.start()
+        attempts[0].add_done_callback(settle)
+        # callers abandoning the result stop the hedge too
+        result.add_done_callback(cancel)
+        return result
+
+    @staticmethod
+    def parse_recipes(recipes, max_workers=8, per_host=2):
+        """ scrape instructions for many recipes at once
+
+        yields (recipe, steps) as each one completes, at most per_host
+        pages are fetched from the same site at any time"""
+        recipes = list(recipes)
+        if not recipes:
+            return
+        host_limits = {}
+        for recipe in recipes:
+            host = urlparse(recipe.url).netloc.lower()
+            if host not in host_limits:
+                host_limits[host] = threading.Semaphore(per_host)
+
+        def parse(recipe):
+            with host_limits[urlparse(recipe.url).netloc.lower()]:
+                return recipe, recipe.parse()
+
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(recipes)))
+        try:
+            futures = [pool.submit(parse, recipe) for recipe in recipes]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Recipe instructions
+# provider source -> callable(soup) returning a list of step strings
+RECIPE_EXTRACTORS = {}
+
+_LD_JSON = re.compile(r'<script[^>]*type\s*=\s*["\']?application/ld\+json'
+                      r'["\']?[^>]*>(.*?)</script\s*>', re.I | re.S)
+
+
+def register_extractor(*sources):
+    """ decorator registering a DOM based instructions extractor
+
+    used only when a page has no usable schema.org Recipe json-ld,
+    third parties can register extra sources or override these ones"""
+
+    def wrapper(func):
+        for source in sources:
+            RECIPE_EXTRACTORS[source] = func
+        return func
+
+    return wrapper
+
+
+def _iter_ld_recipes(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from _iter_ld_recipes(item)
+    elif isinstance(data, dict):
+        if "recipeInstructions" in data:
+            yield data
+        if "@graph" in data:
+            yield from _iter_ld_recipes(data["@graph"])
+
+
+def _flatten_instructions(steps):
+    if isinstance(steps, str):
+        return [line for line in steps.splitlines() if line.strip()]
+    if isinstance(steps, dict):  # a single HowToStep / HowToSection
+        steps = [steps]
+    results = []
+    for step in steps or []:
+        if isinstance(step, str):
+            results.append(step)
+        elif isinstance(step, dict):
+            if "itemListElement" in step:  # HowToSection
+                results += _flatten_instructions(step["itemListElement"])
+            else:
+                results.append(step.get("text") or step.get("name") or "")
+    return results
+
+
+def extract_ld_json_instructions(html):
+    """ recipeInstructions of the first schema.org Recipe in the page
+
+    scans the raw html for ld+json blocks with a regex instead of
+    building a full BeautifulSoup tree"""
+    for block in _LD_JSON.findall(html):
+        try:
+            data = json.loads(block.strip())
+        except ValueError:
+            continue
+        for recipe in _iter_ld_recipes(data):
+            steps = _flatten_instructions(recipe["recipeInstructions"])
+            if steps:
+                return steps
+    return []
+
+
+class _LdJsonScanner(HTMLParser):
+    """ incremental html parser capturing schema.org Recipe instructions
+
+    feed() it chunks as they arrive, steps is filled as soon as the
+    closing tag of a json-ld block holding a Recipe has been seen"""
+
+    def __init__(self):
+        super().__init__()
+        self.steps = []
+        self._capturing = False
+        self._buffer = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "script" and \
+                (dict(attrs).get("type") or "").lower() == "application/ld+json":
+            self._capturing = True
+            self._buffer = []
+
+    def handle_data(self, data):
+        if self._capturing:
+            self._buffer.append(data)
+
+    def handle_endtag(self, tag):
+        if tag != "script" or not self._capturing:
+            return
+        self._capturing = False
+        if self.steps:
+            return
+        try:
+            data = json.loads("".join(self._buffer).strip())
+        except ValueError:
+            return
+        for recipe in _iter_ld_recipes(data):
+            self.steps = _flatten_instructions(recipe["recipeInstructions"])
+            if self.steps:
+                break
+
+
+@register_extractor("food52")
+def _food52(soup):
+    extractor = soup.find("div", {"class": "recipe__list--steps"})
+    return [step.text for step in extractor.find_all("li")]
+
+
+@register_extractor("marthastewart")
+def _marthastewart(soup):
+    extractor = soup.find("ul", {"class": "instructions-section"})
+    results = []
+    for step in extractor.find_all("li"):
+        step_additional_a = step.find("div", {"class": "section-body"})
+        step_additional_b = step_additional_a.find("p")
+        results.append(step_additional_b.text)
+    return results
+
+
+@register_extractor("honestcooking")
+def _honestcooking(soup):
+    extractor = soup.find_all("li", {"itemprop": "recipeInstructions"})
+    return [step.text for step in extractor]
+
+
+@register_extractor("closetcooking")
+def _closetcooking(soup):
+    extractor = soup.find("ol", {"class": "instructions"})
+    return [step.text for step in extractor.find_all("li")]
+
+
+@register_extractor("cookalmostanything")
+def _cookalmostanything(soup):
+    extractor = soup.find("div", {"class": "post-body"})
+    for s in extractor.find_all("center"):
+        s.decompose()
+    return extractor.get_text().split("<br>")
+
+
+@register_extractor("foodrepublic")
+def _foodrepublic(soup):
+    extractor = soup.find("span", {"itemprop": "recipeInstructions"})
+    return [step.text for step in extractor.find_all("li")]
+
+
+@register_extractor("thedailymeal")
+def _thedailymeal(soup):
+    extractor = soup.find("ol", {"class": "recipe-directions"})
+    return [step.text for step in extractor.find_all("li")]
+
+
+@register_extractor("frenchrevolutionfood")
+def _frenchrevolutionfood(soup):
+    extractor = soup.find("div", {"class": "recipe"})
+    orderedlist = extractor.find_all("ol")
+    return [step.text for step in orderedlist[0].find_all("li")]
+
+
+@register_extractor("foodista")
+def _foodista(soup):
+    return [step.text for step in soup.findAll("div", {"class": "step-body"})]
+
+
+@register_extractor("turniptheoven.com")
+def _turniptheoven(soup):
+    extractor = soup.find("ol", {"itemprop": "recipeInstructions"})
+    return [step.text for step in extractor.find_all("li")]
+
+
+@register_extractor("tastykitchen.com")
+def _tastykitchen(soup):
+    extractor = soup.find("span", {"itemprop": "instructions"})
+    return [step.text for step in extractor.find_all("p")]
 
 
 # Data classes
+def _decode_nutrients(value):
+    if isinstance(value, dict):
+        return [Nutrient(n, **value[n]) for n in value]
+    return value or []
+
+
+def _decode_food_nutrients(value):
+    if isinstance(value, dict):
+        return [Nutrient(n, quantity=value[n]) for n in value]
+    return value or []
+
+
+def _decode_digest(value):
+    if isinstance(value, list):
+        return {content["label"]: content for content in value}
+    return value or {}
+
+
+def _encode_nutrients(nutrients):
+    return {n.tag: {"label": n.label, "quantity": n.quantity, "unit": n.unit}
+            for n in nutrients}
+
+
+def _encode_food_nutrients(nutrients):
+    return {n.tag: n.quantity for n in nutrients}
+
+
+def _encode_digest(digest):
+    return list(digest.values())
+
+
+class _Lazy:
+    """ slot backed attribute holding raw json until first access
+
+    the raw api section is kept as is and only decoded into objects when
+    something actually reads it"""
+
+    def __init__(self, decode, decoded_type=list, encode=None):
+        self.decode = decode
+        self.decoded_type = decoded_type
+        self.encode = encode
+
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if not isinstance(value, self.decoded_type):
+            value = self.decode(value)
+            setattr(obj, self.slot, value)
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+    def raw(self, obj):
+        """ the value in api json form, re-encoded if already decoded """
+        value = getattr(obj, self.slot)
+        if isinstance(value, self.decoded_type):
+            return self.encode(value)
+        return value
+
+
+# class -> ((slot, _Lazy or None), ...) in __slots__ order
+_SLOT_LAYOUTS = {}
+
+
+def _slot_layout(cls):
+    layout = _SLOT_LAYOUTS.get(cls)
+    if layout is None:
+        layout = []
+        for slot in cls.__slots__:
+            if slot.startswith("__"):
+                slot = "_%s%s" % (cls.__name__, slot)
+            lazy = cls.__dict__.get(slot[1:])
+            layout.append((slot, lazy if isinstance(lazy, _Lazy) else None))
+        layout = _SLOT_LAYOUTS[cls] = tuple(layout)
+    return layout
+
+
+def _getstate(self):
+    # a flat tuple pickles far smaller and faster than the default slot
+    # dict, lazy sections go back to raw json instead of many Nutrients
+    return tuple(getattr(self, slot) if lazy is None else lazy.raw(self)
+                 for slot, lazy in _slot_layout(type(self)))
+
+
+def _setstate(self, state):
+    for (slot, _), value in zip(_slot_layout(type(self)), state):
+        setattr(self, slot, value)
+
+
 class Measure:
+    __slots__ = ("label", "uri")
+
+    __getstate__ = _getstate
+    __setstate__ = _setstate
+
     def __init__(self, label, uri,
                  **kwargs):
         self.label = label
@@ -153,9 +1839,20 @@ class Measure:
     def __repr__(self):
         return self.label
 
+    def to_dict(self):
+        return {"label": self.label, "uri": self.uri}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
 
 class Nutrient:
     """ A nutrient in some food"""
+    __slots__ = ("tag", "label", "quantity", "unit")
+
+    __getstate__ = _getstate
+    __setstate__ = _setstate
 
     def __init__(self, tag, label=None, quantity=0, unit=None,
                  **kwargs):
@@ -174,9 +1871,27 @@ class Nutrient:
                                                  quantity=self.quantity)
         return name
 
+    def to_dict(self):
+        return {"tag": self.tag, "label": self.label,
+                "quantity": self.quantity, "unit": self.unit}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
 
 class Ingredient:
     """ Nutritional data about an ingredient of some food """
+    __slots__ = ("name", "dietLabels", "healthLabels", "uri", "yields",
+                 "cautions", "totalWeight", "calories",
+                 "_totalDaily", "_totalNutrients", "_totalNutrientsKCal")
+
+    totalDaily = _Lazy(_decode_nutrients, encode=_encode_nutrients)
+    totalNutrients = _Lazy(_decode_nutrients, encode=_encode_nutrients)
+    totalNutrientsKCal = _Lazy(_decode_nutrients, encode=_encode_nutrients)
+
+    __getstate__ = _getstate
+    __setstate__ = _setstate
 
     def __init__(self,
                  name,
@@ -197,26 +1912,27 @@ class Ingredient:
         self.uri = uri
         self.yields = yields
         self.cautions = cautions
-        self.totalDaily = []
-        if isinstance(totalDaily, dict):
-            for n in totalDaily:
-                self.totalDaily += [Nutrient(n, **totalDaily[n])]
-        else:
-            self.totalDaily = totalDaily or []
+        self.totalDaily = totalDaily
         self.totalWeight = totalWeight
-        self.totalNutrientsKCal = []
-        if isinstance(totalNutrientsKCal, dict):
-            for n in totalNutrientsKCal:
-                self.totalNutrientsKCal += [Nutrient(n, **totalNutrientsKCal[n])]
-        else:
-            self.totalNutrientsKCal = totalNutrientsKCal or []
+        self.totalNutrientsKCal = totalNutrientsKCal
         self.calories = calories
-        self.totalNutrients = []
-        if isinstance(totalNutrients, dict):
-            for n in totalNutrients:
-                self.totalNutrients += [Nutrient(n, **totalNutrients[n])]
-        else:
-            self.totalNutrients = totalNutrients or []
+        self.totalNutrients = totalNutrients
+
+    def to_dict(self):
+        """ json compatible dict, from_dict() rebuilds the Ingredient """
+        cls = type(self)
+        return {"name": self.name, "uri": self.uri,
+                "dietLabels": self.dietLabels,
+                "healthLabels": self.healthLabels, "yields": self.yields,
+                "cautions": self.cautions, "totalWeight": self.totalWeight,
+                "calories": self.calories,
+                "totalDaily": cls.totalDaily.raw(self),
+                "totalNutrients": cls.totalNutrients.raw(self),
+                "totalNutrientsKCal": cls.totalNutrientsKCal.raw(self)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
 
     def __str__(self):
         return self.name
@@ -224,6 +1940,13 @@ class Ingredient:
 
 class Food:
     """ something you can eat """
+    __slots__ = ("foodId", "label", "category", "categoryLabel", "measure",
+                 "quantity", "image", "_nutrients")
+
+    nutrients = _Lazy(_decode_food_nutrients, encode=_encode_food_nutrients)
+
+    __getstate__ = _getstate
+    __setstate__ = _setstate
 
     def __init__(self, foodId, label="",
                  category="Generic foods",
@@ -240,15 +1963,25 @@ class Food:
         if isinstance(measure, dict):
             measure = Measure(**measure)
         self.measure = measure
-        self.nutrients = []
-        if isinstance(nutrients, dict):
-            for n in nutrients:
-                self.nutrients += [Nutrient(n, quantity=nutrients[n])]
-        else:
-            self.nutrients = nutrients or []
+        self.nutrients = nutrients
         self.quantity = quantity
         self.image = image
 
+    def to_dict(self):
+        """ json compatible dict, from_dict() rebuilds the Food """
+        return {"foodId": self.foodId, "label": self.label,
+                "category": self.category,
+                "categoryLabel": self.categoryLabel,
+                "measure": None if self.measure is None
+                else self.measure.to_dict(),
+                "quantity": self.quantity,
+                "nutrients": type(self).nutrients.raw(self),
+                "image": self.image}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
     def __str__(self):
         if self.quantity != 1:
             return str(self.quantity) + " * " + self.label
@@ -256,6 +1989,20 @@ class Food:
 
 
 class Recipe:
+    __slots__ = ("ingredient_names", "ingredient_quantities", "cuisineType",
+                 "mealType", "dishType", "label", "dietLabels",
+                 "healthLabels", "uri", "url", "share_url", "source",
+                 "yields", "cautions", "totalWeight", "calories",
+                 "totalTime", "image", "__edamam",
+                 "_totalDaily", "_totalNutrients", "_digest")
+
+    totalDaily = _Lazy(_decode_nutrients, encode=_encode_nutrients)
+    totalNutrients = _Lazy(_decode_nutrients, encode=_encode_nutrients)
+    digest = _Lazy(_decode_digest, dict, _encode_digest)
+
+    __getstate__ = _getstate
+    __setstate__ = _setstate
+
     def __init__(self,
                  label,
                  uri="",
@@ -293,355 +2040,345 @@ class Recipe:
         self.source = source
         self.yields = yields
         self.cautions = cautions
-        self.totalDaily = []
-        if isinstance(totalDaily, dict):
-            for n in totalDaily:
-                self.totalDaily += [Nutrient(n, **totalDaily[n])]
-        else:
-            self.totalDaily = totalDaily or []
+        self.totalDaily = totalDaily
         self.totalWeight = totalWeight
         self.calories = calories
         self.totalTime = totalTime
-        self.totalNutrients = []
-        if isinstance(totalNutrients, dict):
-            for n in totalNutrients:
-                self.totalNutrients += [Nutrient(n, **totalNutrients[n])]
-        else:
-            self.totalNutrients = totalNutrients or []
+        self.totalNutrients = totalNutrients
         self.image = image
-        if isinstance(digest, list):
-            self.digest = {}
-            for content in digest:
-                self.digest[content["label"]] = content
-        else:
-            self.digest = digest or {}
-        self.__edamam = edamam or Edaman()
-
-    def get_ingredients_data(self):
-        for ing in self.__edamam.search_nutrient(self.ingredient_names):
+        self.digest = digest
+        self.__edamam = edamam or PyEdaman()
+
+    def to_dict(self):
+        """ json compatible dict without the api client, from_dict()
+        rebuilds the Recipe """
+        cls = type(self)
+        return {"label": self.label, "uri": self.uri, "url": self.url,
+                "share_url": self.share_url, "image": self.image,
+                "dietLabels": self.dietLabels,
+                "healthLabels": self.healthLabels, "yields": self.yields,
+                "cautions": self.cautions, "totalWeight": self.totalWeight,
+                "calories": self.calories, "totalTime": self.totalTime,
+                "totalDaily": cls.totalDaily.raw(self),
+                "totalNutrients": cls.totalNutrients.raw(self),
+                "digest": cls.digest.raw(self),
+                "ingredients": self.ingredient_quantities,
+                "source": self.source,
+                "ingredient_names": self.ingredient_names,
+                "cuisineType": self.cuisineType,
+                "mealType": self.mealType, "dishType": self.dishType}
+
+    @classmethod
+    def from_dict(cls, data, edamam=None):
+        """ pass edamam when loading many, each Recipe would otherwise
+        build its own client """
+        return cls(edamam=edamam, **data)
+
+    def get_ingredients_data(self, batch=False, max_workers=8):
+        """ nutritional data for every ingredient line of this recipe
+
+        lines are analyzed concurrently and yielded as they complete,
+        batch=True yields a single Ingredient with the recipe totals"""
+        for ing in self.__edamam.search_nutrient(self.ingredient_names,
+                                                 batch=batch,
+                                                 max_workers=max_workers):
             yield ing
 
     def parse(self):
-        return self._get_recipe_instructions(self.source.lower().replace(" ", ""), self.url)
+        steps = self._prefetched()
+        if steps is None:
+            steps = self._scrape()
+        return steps
+
+    def _prefetched(self):
+        """ steps of a background prefetch, None if there is none """
+        prefetcher = getattr(self.__edamam, "prefetcher", None)
+        future = prefetcher.get(self.url) if prefetcher is not None else None
+        if future is None:
+            return None
+        metrics = self.__edamam.metrics
+        metrics.incr("prefetch.%s" % ("hit" if future.done() else "joined"))
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            # scrape again, the page may have been temporarily down
+            metrics.incr("prefetch.failed")
+            logger.debug("prefetch of %s failed: %r", self.url, e)
+            return None
+
+    def _scrape(self):
+        source = self.source.lower().replace(" ", "")
+        with self.__edamam.metrics.timer("recipe.parse." + source):
+            return self._get_recipe_instructions(source, self.url)
+
+    def iter_instructions(self, max_bytes=2 * 1024 * 1024, chunk_size=16384):
+        """ instruction steps, reading as little of the page as possible
+
+        the page is fed to an incremental parser chunk by chunk and the
+        download stops as soon as a schema.org Recipe json-ld block has
+        been captured, or once max_bytes have been read. Sites without
+        json-ld fall back to the DOM extractors on what was downloaded,
+        steps found in a page cut at max_bytes are not cached. steps are
+        only yielded once the extraction finished"""
+        steps = self._prefetched()
+        if steps is None:
+            source = self.source.lower().replace(" ", "")
+            with self.__edamam.metrics.timer("recipe.parse." + source):
+                steps = self._get_recipe_instructions(
+                    source, self.url,
+                    partial(self._scan_page, source, max_bytes, chunk_size),
+                    stream=True)
+        for step in steps:
+            yield step["step"]
+
+    def _scan_page(self, source, max_bytes, chunk_size, resp):
+        """ (steps, complete) of a streamed page, stops reading at the
+        json-ld, complete is False if the page was cut at max_bytes """
+        content_type = resp.headers.get("Content-Type", "").lower()
+        encoding = resp.encoding if "charset" in content_type else "utf-8"
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        scanner = _LdJsonScanner()
+        html = []
+        size = 0
+        truncated = False
+        for chunk in resp.iter_content(chunk_size):
+            size += len(chunk)
+            text = decoder.decode(chunk)
+            html.append(text)
+            scanner.feed(text)
+            if scanner.steps:
+                break
+            if size >= max_bytes:
+                truncated = True
+                break
+        results = [item.strip() for item in scanner.steps if item.strip()]
+        if results:
+            return results, True
+        return self._get_provider_result(source, "".join(html)), \
+            not truncated
+
+    def _get_recipe_instructions(self, source, source_url, extract=None,
+                                 stream=False):
+        """ [{"step": text}] for source_url through the instruction cache
+
+        fresh entries are served as is, stale ones are revalidated and
+        kept when the site fails, extract(resp) turns a downloaded page
+        into (step strings, complete), incomplete steps aren't cached"""
+        if extract is None:
+            def extract(resp):
+                return self._get_provider_result(source, resp.text), True
+        metrics = self.__edamam.metrics
+        cache = self.__edamam.instruction_cache
+        entry = cache.get(source_url) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry):
+            metrics.incr("instruction_cache.hit")
+            return entry.steps
+        if cache is not None:
+            metrics.incr("instruction_cache.miss")
+
+        headers = cache.validators(entry) if entry is not None else {}
+        try:
+            with metrics.timer("scrape." + source):
+                resp = self.__edamam.scrape_transport.request(
+                    "GET", source_url, headers=headers,
+                    timeout=self.__edamam.timeout, stream=stream)
+        except Exception:
+            if entry is None:
+                raise
+            # site down, stale steps beat none
+            metrics.incr("instruction_cache.stale")
+            return entry.steps
+        try:
+            if entry is not None and resp.status_code == 304:
+                metrics.incr("instruction_cache.revalidated")
+                cache.touch(source_url)
+                return entry.steps
+            if entry is not None and not resp.ok:
+                metrics.incr("instruction_cache.stale")
+                return entry.steps
+            results, complete = extract(resp)
+        finally:
+            resp.close()
 
-    def _get_recipe_instructions(self, source, source_url):
-        results = []
         final_results = []
-        scraper = cloudscraper.create_scraper()
-        resp = scraper.get(source_url)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        results = self._get_provider_result(source, soup)
-
+        seen = set()
         for item in results:
-            if item not in final_results:
+            if item not in seen:
+                seen.add(item)
                 final_results.append({"step": item})
 
+        if cache is not None and final_results and resp.ok and complete:
+            cache.put(source_url, final_results,
+                      etag=resp.headers.get("ETag"),
+                      last_modified=resp.headers.get("Last-Modified"))
         return final_results
 
-    def _get_provider_result(self, provider_source, soup):
-        # TODO - refacyot this, initial copy pasta from food wizard skill
+    def _get_provider_result(self, provider_source, html):
+        """ schema.org json-ld first, site specific DOM parsing if that fails """
+        metrics = self.__edamam.metrics
         try:
-            results = []
-            if provider_source == 'food52':
-                extractor = soup.find("div", {"class": "recipe__list--steps"})
-                steps = extractor.find_all("li")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == 'epicurious':
-                extractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                json_data = json.loads(extractor.contents[0])
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "seriouseats":
-                extractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                data_source = extractor[0].contents[0]
-                json_data = json.loads(data_source)
-                for data in json_data:
-                    steps = data.get("recipeInstructions", "")
-                    if steps:
-                        for step in steps:
-                            text = step.get("text", "")
-                            results.append(text)
-
-            if provider_source == "marthastewart":
-                extractor = soup.find("ul", {"class": "instructions-section"})
-                steps = extractor.find_all("li")
-
-                for step in steps:
-                    step_additional_a = step.find(
-                        "div", {"class": "section-body"})
-                    step_additional_b = step_additional_a.find("p")
-                    results.append(step_additional_b.text)
-
-            if provider_source == "whiteonricecouple":
-                extractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                json_data = json.loads(extractor.contents[0])
-                data_filter = json_data["@graph"]
-                for data in data_filter:
-                    if data["@type"] == "Recipe":
-                        steps = data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step.get("text", ""))
-
-            if provider_source == "bonappetit":
-                extractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                json_data = json.loads(extractor.contents[0])
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "tastingtable":
-                extractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                json_data = json.loads(extractor[1].contents[0])
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "honestcooking":
-                extractor = soup.find_all(
-                    "li", {"itemprop": "recipeInstructions"})
-                for step in extractor:
-                    results.append(step.text)
-
-            if provider_source == "foodandwine":
-                extractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                data = json.loads(extractor.contents[0])
-                json_data = data[0]
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "eatingwell":
-                exctractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                data = json.loads(exctractor.contents[0])
-                json_data = data[1]
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "cookstr":
-                extractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                json_data = json.loads(extractor[1].contents[0])
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "bbcgoodfood":
-                exctractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                data = json.loads(exctractor.contents[0])
-                steps = data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "delish":
-                exctractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                data = json.loads(exctractor.contents[0])
-                steps = data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "pioneerwoman":
-                exctractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                data = json.loads(exctractor.contents[0])
-                steps = data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "foodnetwork":
-                exctractor = soup.find(
-                    "script", {"type": "application/ld+json"})
-                data = json.loads(exctractor.contents[0])
-                json_data = data[0]
-                steps = json_data["recipeInstructions"]
-
-                for step in steps:
-                    text = step.get("text", "")
-                    results.append(text)
-
-            if provider_source == "closetcooking":
-                exctractor = soup.find("ol", {"class": "instructions"})
-                steps = exctractor.find_all("li")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == "cookalmostanything":
-                exctractor = soup.find("div", {"class": "post-body"})
-                for s in exctractor.find_all("center"):
-                    s.decompose()
-                steps = exctractor.get_text().split("<br>")
-                for step in steps:
-                    results.append(step)
-
-            if provider_source == "bbc":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    if "recipeInstructions" in json_data:
-                        steps = json_data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step)
-
-            if provider_source == "foodrepublic":
-                exctractor = soup.find(
-                    "span", {"itemprop": "recipeInstructions"})
-                steps = exctractor.find_all("li")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == "simplyrecipes":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    data = json_data[0]
-                    if "recipeInstructions" in data:
-                        steps = data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step.get("text", ""))
-
-            if provider_source == "latimes":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    if "recipeInstructions" in json_data:
-                        steps = json_data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step.get("text", ""))
-
-            if provider_source == "thedailymeal":
-                exctractor = soup.find("ol", {"class": "recipe-directions"})
-                steps = exctractor.find_all("li")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == "saveur":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    if "recipeInstructions" in json_data:
-                        steps = json_data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step.get("text", ""))
-
-            if provider_source == "frenchrevolutionfood":
-                exctractor = soup.find("div", {"class": "recipe"})
-                orderedlist = exctractor.find_all("ol")
-                steps = orderedlist[0].find_all("li")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == "food.com":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    if "recipeInstructions" in json_data:
-                        steps = json_data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step.get("text", ""))
-
-            if provider_source == "foodista":
-                exctractor = soup.findAll("div", {"class": "step-body"})
-                for step in exctractor:
-                    results.append(step.text)
-
-            if provider_source == "turniptheoven.com":
-                extractor = soup.find("ol", {"itemprop": "recipeInstructions"})
-                steps = extractor.find_all("li")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == "tastykitchen.com":
-                exctractor = soup.find("span", {"itemprop": "instructions"})
-                steps = exctractor.find_all("p")
-
-                for step in steps:
-                    results.append(step.text)
-
-            if provider_source == "nomnompaleo":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    graph_data = json_data["@graph"]
-                    for data in graph_data:
-                        if "recipeInstructions" in data:
-                            steps = data["recipeInstructions"]
-                            for step in steps:
-                                results.append(step.get("text", ""))
-
-            if provider_source == "justapinch.com":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    if "recipeInstructions" in json_data:
-                        steps = json_data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step)
-
-            if provider_source == "foxeslovelemons.com":
-                exctractor = soup.findAll(
-                    "script", {"type": "application/ld+json"})
-                for data in exctractor:
-                    json_data = json.loads(data.contents[0])
-                    if "recipeInstructions" in json_data:
-                        steps = json_data["recipeInstructions"]
-                        for step in steps:
-                            results.append(step.get("text", ""))
-
-            results = [item.strip() for item in results if item.strip()]
-            return results
+            with metrics.timer("extract." + provider_source):
+                results = extract_ld_json_instructions(html)
+                if not results:
+                    extractor = RECIPE_EXTRACTORS.get(provider_source)
+                    if extractor is not None:
+                        from bs4 import BeautifulSoup
+                        soup = BeautifulSoup(html, "html.parser")
+                        results = extractor(soup)
+            return [item.strip() for item in results if item.strip()]
 
         except Exception as e:
-            print("Error Getting Recipe Instructions: %s", e)
+            metrics.incr("errors.extract")
+            logger.error("Error Getting Recipe Instructions: %s", e)
             return []
 
     def __str__(self):
         return self.label
 
 
+class MealLog:
+    """ analyzed meal log, a day of free text lines like "2 eggs"
+
+    lines keep their order and repetitions, totals count a line once per
+    time it was logged while each distinct line is only analyzed once"""
+
+    def __init__(self, lines):
+        self.lines = [line.strip() for line in lines if line and line.strip()]
+        # normalized line -> Ingredient / exception
+        self.results = {}
+        self.errors = {}
+
+    def add(self, line, ingredient=None, error=None):
+        key = TTLCache.normalize(line)
+        if error is not None:
+            self.errors[key] = error
+        else:
+            self.results[key] = ingredient
+
+    @property
+    def ingredients(self):
+        """ Ingredient per line, None for failed or pending ones """
+        return [self.results.get(TTLCache.normalize(line))
+                for line in self.lines]
+
+    @property
+    def failed(self):
+        return [line for line in self.lines
+                if TTLCache.normalize(line) in self.errors]
+
+    @property
+    def complete(self):
+        return all(TTLCache.normalize(line) in self.results or
+                   TTLCache.normalize(line) in self.errors
+                   for line in self.lines)
+
+    @property
+    def calories(self):
+        return sum(ing.calories for ing in self.ingredients if ing)
+
+    def totals(self, section="totalNutrients"):
+        """ summed Nutrient list over the analyzed lines """
+        summed = OrderedDict()
+        for ing in self.ingredients:
+            if ing is None:
+                continue
+            for n in getattr(ing, section):
+                total = summed.get(n.tag)
+                if total is None:
+                    summed[n.tag] = Nutrient(n.tag, n.label, n.quantity,
+                                             n.unit)
+                else:
+                    total.quantity += n.quantity
+        return list(summed.values())
+
+    @property
+    def totalNutrients(self):
+        return self.totals("totalNutrients")
+
+    @property
+    def totalDaily(self):
+        return self.totals("totalDaily")
+
+    def __len__(self):
+        return len(self.lines)
+
+
+# binary snapshots of data objects, a version header followed by a pickle
+# (protocol 5) of the objects themselves, loading skips every constructor
+SNAPSHOT_MAGIC = b"PYEDAMAM"
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_CLASSES = {cls.__name__: cls for cls in
+                     (Measure, Nutrient, Ingredient, Food, Recipe)}
+# stands in for the api client held by every Recipe
+_CLIENT_ID = "edamam"
+
+
+class _SnapshotPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        if isinstance(obj, Edaman):
+            return _CLIENT_ID
+        return None
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, edamam):
+        super().__init__(file)
+        self.edamam = edamam
+
+    def persistent_load(self, pid):
+        if pid != _CLIENT_ID:
+            raise pickle.UnpicklingError("unknown persistent id %r" % pid)
+        if self.edamam is None:
+            self.edamam = PyEdaman()
+        return self.edamam
+
+    def find_class(self, module, name):
+        # only data objects, a snapshot must never run arbitrary code.
+        # the module may be imported as pyedaman or <skill>.pyedaman
+        if module.split(".")[-1] in ("pyedaman", "__main__") and \
+                name in _SNAPSHOT_CLASSES:
+            return _SNAPSHOT_CLASSES[name]
+        raise pickle.UnpicklingError("%s.%s is not allowed in a snapshot"
+                                     % (module, name))
+
+
+def dumps_snapshot(objects):
+    """ bytes holding Recipe, Ingredient, Food and Nutrient objects
+
+    api clients are left out, lazily decoded sections are kept in
+    whichever form they currently are"""
+    buf = io.BytesIO()
+    buf.write(SNAPSHOT_MAGIC + SNAPSHOT_VERSION.to_bytes(2, "big"))
+    _SnapshotPickler(buf, protocol=5).dump(objects)
+    return buf.getvalue()
+
+
+def loads_snapshot(data, edamam=None):
+    """ objects from dumps_snapshot(), Recipes get edamam as client (one
+    shared PyEdaman is created when needed if None) """
+    header = len(SNAPSHOT_MAGIC) + 2
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError("not a pyedamam snapshot")
+    version = int.from_bytes(data[len(SNAPSHOT_MAGIC):header], "big")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError("unsupported snapshot version: %s" % version)
+    return _SnapshotUnpickler(io.BytesIO(data[header:]), edamam).load()
+
+
+def save_snapshot(path, objects):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(dumps_snapshot(objects))
+    os.replace(tmp, path)
+
+
+def load_snapshot(path, edamam=None):
+    with open(path, "rb") as f:
+        return loads_snapshot(f.read(), edamam)
+
+
 if __name__ == "__main__":
 
     e = PyEdaman()
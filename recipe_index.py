@@ -0,0 +1,234 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    from .pyedaman import UNITS
+except ImportError:  # running from a checkout
+    from pyedaman import UNITS
+
+# labels are matched as whole phrases, eg. "dairy-free" or "main course"
+LABEL_FIELDS = ("healthLabels", "dietLabels", "cuisineType", "mealType",
+                "dishType")
+# how much a matching term in each field counts when ranking
+WEIGHTS = {"label": 2.0, "title": 1.5, "ingredient": 1.0}
+_NOISE = set(UNITS) | {"to", "taste", "and", "or", "of", "for", "the",
+                       "fresh", "freshly", "chopped", "sliced", "minced",
+                       "diced", "ground", "optional", "about", "into",
+                       "cut", "plus", "more", "divided", "finely", "thinly"}
+_WORD = re.compile(r"[a-z][a-z'-]+")
+_NEGATION = re.compile(r"^(?:(?:no|not|without)\s+|non-|-)")
+
+
+def _stem(word):
+    # crude, but queries and recipes go through the same function
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith(("ss", "us")) and \
+            len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def tokens(text):
+    """ stemmed ingredient / title words of text, units and noise removed """
+    return {_stem(w) for w in _WORD.findall(str(text).lower())
+            if w not in _NOISE}
+
+
+def _label(text):
+    return " ".join(str(text).lower().split())
+
+
+def parse_query(query):
+    """ split "chicken, no dairy, dinner" into (wanted, unwanted) terms """
+    wanted, unwanted = [], []
+    query = re.sub(r"\b(?:but )?without\b", ", no", str(query).lower())
+    for part in re.split(r",|;|\band\b|\bwith\b|\bbut\b", query):
+        part = part.strip()
+        if not part:
+            continue
+        negated = _NEGATION.match(part)
+        if negated:
+            unwanted.append(_label(part[negated.end():]))
+        else:
+            wanted.append(_label(part))
+    return [w for w in wanted if w], [u for u in unwanted if u]
+
+
+class RecipeIndex:
+    """ persistent inverted index of every recipe hit the client has seen
+
+    ingredient words, title words and health / diet / cuisine / meal /
+    dish labels point to the stored raw hit, so filtered questions like
+    "chicken, no dairy, dinner" are answered locally. PyEdaman.search_recipe
+    only calls the api when the index has too few fresh matches"""
+
+    def __init__(self, path=":memory:", max_age=30 * 24 * 3600,
+                 min_results=5):
+        self.path = path
+        # seconds before a stored recipe is ignored until seen again
+        self.max_age = max_age
+        # lookup() answers only with at least min(wanted, min_results)
+        self.min_results = min_results
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS recipes (
+                uri TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT NOT NULL,
+                field TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                PRIMARY KEY (term, field, uri)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS terms_uri ON terms (uri);
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def _terms(recipe):
+        terms = set()
+        for field in LABEL_FIELDS:
+            for label in recipe.get(field) or []:
+                # edamam reports meals like "lunch/dinner"
+                for part in str(label).split("/"):
+                    terms.add((_label(part), "label"))
+        for word in tokens(recipe.get("label", "")):
+            terms.add((word, "title"))
+        words = set()
+        for line in recipe.get("ingredientLines") or []:
+            words |= tokens(line)
+        for ing in recipe.get("ingredients") or []:
+            words |= tokens(ing.get("food", ""))
+        terms.update((word, "ingredient") for word in words)
+        return terms
+
+    def add(self, hits):
+        """ store raw api hits, replacing older copies of the same recipe """
+        now = time.time()
+        rows, terms = [], []
+        for hit in hits:
+            recipe = hit.get("recipe") or {}
+            uri = recipe.get("uri")
+            if not uri:
+                continue
+            rows.append((uri, json.dumps(hit), now))
+            terms.extend((term, field, uri)
+                         for term, field in self._terms(recipe))
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("DELETE FROM terms WHERE uri = ?",
+                                 [(r[0],) for r in rows])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO recipes VALUES (?, ?, ?)", rows)
+            self._db.executemany(
+                "INSERT OR IGNORE INTO terms VALUES (?, ?, ?)", terms)
+            self._db.commit()
+
+    def _matching(self, term):
+        """ {uri: field weight} of recipes matching one query term """
+        words = tokens(term)
+        with self._lock:
+            labelled = self._db.execute(
+                "SELECT uri FROM terms WHERE term = ? AND field = 'label'",
+                (term,)).fetchall()
+            per_word = []
+            for word in words:
+                per_word.append(self._db.execute(
+                    "SELECT uri, field FROM terms WHERE term = ? "
+                    "AND field != 'label'", (word,)).fetchall())
+        scores = {uri: WEIGHTS["label"] for uri, in labelled}
+        if per_word:
+            # every word of "chicken thigh" must be present, each counts
+            # with the best field it was found in
+            common = set.intersection(*({uri for uri, _ in rows}
+                                        for rows in per_word))
+            words_score = dict.fromkeys(common, 0.0)
+            for rows in per_word:
+                best = {}
+                for uri, field in rows:
+                    if uri in common:
+                        best[uri] = max(best.get(uri, 0), WEIGHTS[field])
+                for uri, weight in best.items():
+                    words_score[uri] += weight / len(per_word)
+            for uri, score in words_score.items():
+                scores[uri] = max(scores.get(uri, 0), score)
+        return scores
+
+    def _has_label(self, label):
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM terms WHERE term = ? AND field = 'label' "
+                "LIMIT 1", (label,)).fetchone() is not None
+
+    def search(self, query, limit=10):
+        """ ranked [(score, raw hit)] of fresh recipes matching query
+
+        every wanted term must match a label, the title or the
+        ingredients, "no dairy" requires the "dairy-free" label when
+        edamam has one and otherwise excludes recipes with dairy in them"""
+        wanted, unwanted = parse_query(query)
+        if not wanted and not unwanted:
+            return []
+        scores = None
+        for term in wanted:
+            matches = self._matching(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {uri: scores[uri] + matches[uri]
+                          for uri in scores.keys() & matches.keys()}
+            if not scores:
+                return []
+        for term in unwanted:
+            free = term + "-free"
+            if self._has_label(free):
+                allowed = self._matching(free)
+                if scores is None:
+                    scores = allowed
+                else:
+                    scores = {uri: s for uri, s in scores.items()
+                              if uri in allowed}
+            elif scores is not None:
+                for uri in self._matching(term):
+                    scores.pop(uri, None)
+        if not scores:
+            return []
+
+        ranked = sorted(scores.items(), key=lambda s: s[1], reverse=True)
+        results = []
+        with self._lock:
+            for uri, score in ranked:
+                row = self._db.execute(
+                    "SELECT data, updated FROM recipes WHERE uri = ?",
+                    (uri,)).fetchone()
+                if row is None or not self._fresh(row[1]):
+                    continue
+                results.append((score, json.loads(row[0])))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def _fresh(self, updated):
+        return self.max_age is None or time.time() - updated < self.max_age
+
+    def lookup(self, query, wanted=10):
+        """ raw hits for query, or None if the api should be asked """
+        results = self.search(query, limit=wanted)
+        if len(results) < min(wanted, self.min_results):
+            return None
+        return [hit for _, hit in results]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,319 @@
+"""record/replay transports and a local stand-in Edamam server
+
+    # record real traffic once
+    e = PyEdaman(transport=CassetteTransport("edamam.json", mode="record"))
+
+    # replay it offline, unknown requests raise CassetteMiss
+    e = PyEdaman(transport=CassetteTransport("edamam.json"))
+
+    # or serve it over http for load tests, with latency and errors
+    python replay.py --cassette edamam.json --port 8080 --latency 0.2
+    e = PyEdaman(base_url="http://127.0.0.1:8080")
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+try:
+    from .pyedaman import RequestsTransport, Transport
+except ImportError:  # running from a checkout
+    from pyedaman import RequestsTransport, Transport
+
+CASSETTE_VERSION = 1
+# never written to disk, never used to match requests
+SECRET_PARAMS = ("app_id", "app_key")
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+# endpoint path -> fixture file, see benchmarks/fixtures
+ROUTES = {"/search": "recipe_search.json",
+          "/api/nutrition-details": "nutrition_details.json",
+          "/api/food-database/parser": "food_parser.json"}
+
+
+class CassetteMiss(LookupError):
+    """ raised when replaying a request that was never recorded """
+
+
+class ReplayResponse:
+    """ recorded response, quacks like requests.Response """
+
+    def __init__(self, status_code=200, body=b"", headers=None,
+                 encoding="utf-8"):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = body
+        self.headers = headers or {}
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=8192, decode_unicode=False):
+        for idx in range(0, len(self.content), chunk_size):
+            yield self.content[idx:idx + chunk_size]
+
+    def close(self):
+        pass
+
+
+def request_key(method, url, params=None, data=None):
+    """ hashable identity of a request, api keys excluded """
+    parsed = urlparse(url)
+    query = dict(parse_qsl(parsed.query))
+    query.update({k: str(v) for k, v in (params or {}).items()})
+    for secret in SECRET_PARAMS:
+        query.pop(secret, None)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return (method.upper(), parsed.netloc + parsed.path,
+            tuple(sorted(query.items())), data or None)
+
+
+class FixtureTransport(Transport):
+    """ answers every request for a path with the same canned body """
+
+    def __init__(self, routes):
+        # path -> bytes
+        self.routes = routes
+
+    @classmethod
+    def from_directory(cls, directory, routes=ROUTES):
+        bodies = {}
+        for path, name in routes.items():
+            with open(os.path.join(directory, name), "rb") as f:
+                bodies[path] = f.read()
+        return cls(bodies)
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        body = self.routes.get(urlparse(url).path)
+        if body is None:
+            return ReplayResponse(404, b'{"status": "error"}')
+        return ReplayResponse(200, body, {"Content-Type": "application/json"})
+
+
+class CassetteTransport(Transport):
+    """ record real responses to a json cassette and replay them
+
+    mode is "record" (always hit inner and store), "replay" (never touch
+    the network) or "auto" (replay when recorded, record otherwise)"""
+
+    def __init__(self, path, mode="replay", inner=None):
+        self.path = path
+        self.mode = mode
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._interactions = {}
+        if os.path.isfile(path):
+            self.load()
+        if mode != "replay" and self.inner is None:
+            self.inner = RequestsTransport()
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError("unsupported cassette version: %s" %
+                             data.get("version"))
+        for entry in data["interactions"]:
+            req = entry["request"]
+            key = request_key(req["method"], req["url"], req["params"],
+                              req["data"])
+            self._interactions[key] = entry["response"]
+
+    def save(self):
+        interactions = []
+        for (method, url, params, data), resp in self._interactions.items():
+            interactions.append({"request": {"method": method,
+                                             "url": "https://" + url,
+                                             "params": dict(params),
+                                             "data": data},
+                                 "response": resp})
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": CASSETTE_VERSION,
+                       "interactions": interactions}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _response(recorded):
+        return ReplayResponse(recorded["status"],
+                              recorded["body"].encode("utf-8"),
+                              recorded["headers"])
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        key = request_key(method, url, params, data)
+        if self.mode != "record":
+            recorded = self._interactions.get(key)
+            if recorded is not None:
+                return self._response(recorded)
+            if self.mode == "replay":
+                raise CassetteMiss("%s %s %s" % key[:3])
+
+        resp = self.inner.request(method, url, params=params, data=data,
+                                  headers=headers, timeout=timeout)
+        recorded = {"status": resp.status_code,
+                    "headers": {h: resp.headers[h] for h in KEPT_HEADERS
+                                if h in resp.headers},
+                    "body": resp.content.decode(resp.encoding or "utf-8",
+                                                "replace")}
+        resp.close()
+        with self._lock:
+            self._interactions[key] = recorded
+            self.save()
+        return self._response(recorded)
+
+    def items(self):
+        """ (request key, recorded response) pairs """
+        return list(self._interactions.items())
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+    def __len__(self):
+        return len(self._interactions)
+
+
+class EdamamStandInServer:
+    """ local http server emulating the recipe search, nutrition-details
+    and food-database parser endpoints
+
+    answers come from a cassette (exact request match) or fall back to a
+    canned response per endpoint, so any query works for load tests.
+    latency + uniform(0, jitter) seconds are added to every answer and
+    error_rate of them fail with error_status, or with edamam's
+    low_quality error for nutrition-details"""
+
+    def __init__(self, cassette=None, routes=None, host="127.0.0.1", port=0,
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_status=500,
+                 seed=None):
+        self.cassette = cassette
+        self.routes = routes or {}
+        # cassette entries keyed like incoming requests, without the host
+        self._recorded = {}
+        if cassette is not None:
+            for (method, url, params, data), resp in cassette.items():
+                path = "/" + url.split("/", 1)[-1] if "/" in url else "/"
+                self._recorded[(method, path, params, data)] = resp
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._thread = None
+        self.requests = 0
+        self.errors = 0
+        self.httpd = ThreadingHTTPServer((host, port), _StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stand_in = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, method, path, data=None):
+        """ (status, body bytes) for a request """
+        self.requests += 1
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+        parsed = urlparse(path)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            if parsed.path == "/api/nutrition-details":
+                return 555, b'{"error": "low_quality"}'
+            return self.error_status, \
+                b'{"status": "error", "message": "injected failure"}'
+
+        key = request_key(method, path, data=data)
+        recorded = self._recorded.get(key)
+        if recorded is not None:
+            return recorded["status"], recorded["body"].encode("utf-8")
+
+        body = self.routes.get(parsed.path)
+        if body is None:
+            return 404, b'{"status": "error", "message": "unknown endpoint"}'
+        return 200, body
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self, data=None):
+        status, body = self.server.stand_in.respond(self.command, self.path,
+                                                    data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._answer()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._answer(self.rfile.read(length).decode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="local stand-in for the Edamam api")
+    parser.add_argument("--cassette", help="recorded cassette to replay")
+    parser.add_argument("--fixtures", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures"),
+        help="directory with a canned answer per endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+
+    cassette = CassetteTransport(args.cassette) if args.cassette else None
+    routes = FixtureTransport.from_directory(args.fixtures).routes \
+        if os.path.isdir(args.fixtures) else {}
+    server = EdamamStandInServer(cassette, routes, args.host, args.port,
+                                 args.latency, args.jitter, args.error_rate,
+                                 args.error_status)
+    print("serving edamam stand-in on", server.url)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyedaman import PyEdaman, RateLimiter, Transport  # noqa: E402
+from replay import FixtureTransport  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+class CountingTransport(Transport):
+    """ canned fixture answers after latency seconds, counts requests """
+
+    def __init__(self, latency=0.1):
+        self.fixtures = FixtureTransport.from_directory(FIXTURES)
+        self.latency = latency
+        self.sent = 0
+
+    def request(self, *args, **kwargs):
+        self.sent += 1
+        time.sleep(self.latency)
+        return self.fixtures.request(*args, **kwargs)
+
+
+def test_paused_reader_does_not_hold_back_others():
+    transport = CountingTransport()
+    e = PyEdaman(transport=transport)
+
+    def slow_reader():
+        hits = e.search_recipe("chicken", max_results=10)
+        next(hits)
+        time.sleep(1)
+        list(hits)
+
+    thread = threading.Thread(target=slow_reader)
+    thread.start()
+    time.sleep(0.02)
+    start = time.monotonic()
+    assert len(list(e.search_recipe("chicken", max_results=10))) == 10
+    assert time.monotonic() - start < 0.5
+    thread.join()
+    assert transport.sent == 1
+
+
+def test_closing_early_stops_the_download():
+    e = PyEdaman(transport=CountingTransport(0), cache_size=0)
+    hits = e.search_recipe("chicken", max_results=10)
+    next(hits)
+    hits.close()
+    assert e.metrics.snapshot()["counters"]["api.recipe.hits"] == 1
+
+
+def test_readers_queued_for_quota_share_one_request():
+    transport = CountingTransport(0)
+    e = PyEdaman(transport=transport, rate_limiter=RateLimiter(1, 1),
+                 timeout=(0.1, 0.1))
+    list(e.search_recipe("warm up", max_results=1))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        list(e.search_recipe("chicken", max_results=1)))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [len(r) for r in results] == [1, 1, 1]
+    assert transport.sent == 2
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyedaman import (CredentialPool, Edaman, InvalidRecipeApiKey,  # noqa: E402
+                      RateLimited, Transport)
+from replay import ReplayResponse  # noqa: E402
+
+
+class ScriptedTransport(Transport):
+    """ answers requests with the given statuses, in order """
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.sent = []
+
+    def request(self, method, url, params=None, **kwargs):
+        self.sent.append(params["app_id"])
+        status, headers = self.answers.pop(0)
+        return ReplayResponse(status, b'{"hits": []}', headers)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    return slept
+
+
+def test_success_clears_401_cooldown(sleeps):
+    transport = ScriptedTransport((401, {}), (200, {}), (200, {}))
+    e = Edaman(transport=transport)
+    with pytest.raises(InvalidRecipeApiKey):
+        e.search_recipe("chicken")
+    e.search_recipe("chicken")
+    e.search_recipe("chicken")
+    assert sleeps == []
+    usage = e.key_usage()["recipe"][0]
+    assert usage["cooling"] == 0 and not usage["invalid"]
+    assert usage["failures"] == 0
+
+
+def test_single_key_429_raises_instead_of_sleeping(sleeps):
+    transport = ScriptedTransport((429, {}))
+    pool = CredentialPool([("id", "key")], cooldown=60, max_wait=5)
+    e = Edaman(transport=transport, recipes_keys=pool)
+    with pytest.raises(RateLimited):
+        e.search_recipe("chicken")
+    # the only key is cooling for 60s, more than max_wait
+    with pytest.raises(RateLimited):
+        e.search_recipe("chicken")
+    assert sleeps == []
+    assert transport.sent == ["id"]
+
+
+def test_429_fails_over_to_next_key(sleeps):
+    transport = ScriptedTransport((429, {"Retry-After": "30"}), (200, {}))
+    e = Edaman(transport=transport,
+               recipes_keys=[("a", "1"), ("b", "2")])
+    e.search_recipe("chicken")
+    assert transport.sent == ["a", "b"]
+    assert sleeps == []
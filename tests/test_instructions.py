@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instruction_cache import InstructionCache  # noqa: E402
+from pyedaman import PyEdaman, Recipe, Transport  # noqa: E402
+from replay import ReplayResponse  # noqa: E402
+
+PAGE = b"<html><body>" + b"<p>ad</p>" * 5000 + b"<ol><li>Mix</li></ol>" \
+    b"</body></html>"
+
+
+class PageTransport(Transport):
+    def request(self, method, url, **kwargs):
+        return ReplayResponse(200, PAGE, {"Content-Type": "text/html"})
+
+
+def _recipe(monkeypatch):
+    # DOM extraction needs bs4, pretend it found one step
+    monkeypatch.setattr(Recipe, "_get_provider_result",
+                        lambda self, source, html: ["Mix"])
+    cache = InstructionCache()
+    e = PyEdaman(scrape_transport=PageTransport(), instruction_cache=cache)
+    return Recipe("Onion Chicken", url="https://example.com/r",
+                  source="example", edamam=e), cache
+
+
+def test_page_cut_at_max_bytes_is_not_cached(monkeypatch):
+    recipe, cache = _recipe(monkeypatch)
+    assert list(recipe.iter_instructions(max_bytes=1024,
+                                         chunk_size=512)) == ["Mix"]
+    assert cache.get(recipe.url) is None
+
+
+def test_complete_page_is_cached(monkeypatch):
+    recipe, cache = _recipe(monkeypatch)
+    assert list(recipe.iter_instructions()) == ["Mix"]
+    assert cache.get(recipe.url).steps == [{"step": "Mix"}]